@@ -1,15 +1,132 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, Blueprint, render_template, request, redirect, url_for, flash, abort, session, make_response, g, has_request_context, jsonify, before_render_template, template_rendered
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import delete, event, func, insert, inspect, literal, select, text, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, selectinload
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
-from datetime import datetime
+import json
+import base64
+import binascii
+import csv
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import math
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import wraps
+from itertools import chain, groupby, islice
+from markupsafe import Markup, escape
+import click
+from dotenv import load_dotenv
+from cache import RateLimiter, TTLCache
+from metrics import Registry
+
+load_dotenv()
 
 app = Flask(__name__)
-app.config['SECRET_KEY'] = os.urandom(24)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///shop.db'
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or os.urandom(24)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///shop.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+# Size the pool for the number of request threads per worker. In-memory SQLite shares one
+# connection through a StaticPool, which takes no sizing options.
+database_url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+if database_url.get_backend_name() == 'sqlite' and database_url.database in (None, '', ':memory:'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {}
+else:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 8)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 4)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+    }
+# Optional separate connection for read-only routes, e.g. sqlite:///file:shop.db?mode=ro&uri=true
+if os.environ.get('DATABASE_READ_URL'):
+    app.config['SQLALCHEMY_BINDS'] = {'read': os.environ['DATABASE_READ_URL']}
+# Applied to every new SQLite connection
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+}
+app.config['PRODUCTS_PER_PAGE'] = 24
+app.config['CATALOG_CACHE_SIZE'] = 4096
+app.config['CATALOG_CACHE_TTL'] = 300
+app.config['RENDER_CACHE_SIZE'] = 2048
+app.config['RENDER_CACHE_TTL'] = 300
+app.config['SEARCH_RESULTS_PER_PAGE'] = 24
+# Deep pages cost a full ranked scan each; nobody pages this far through search results
+app.config['SEARCH_MAX_PAGE'] = 100
+app.config['API_MAX_PAGE_SIZE'] = 100
+app.config['API_MAX_CART_OPERATIONS'] = 100
+app.config['MAX_CART_QUANTITY'] = 1000
+app.config['IMPORT_BATCH_SIZE'] = 1000
+# Statements slower than this are logged as warnings
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))
+# Add a Server-Timing header with per-request time, SQL and template stats
+app.config['REQUEST_TIMING_HEADER'] = os.environ.get('REQUEST_TIMING_HEADER', '').lower() in ('1', 'true', 'yes')
+# When set, /metrics requires "Authorization: Bearer <token>"
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+# Password hashing runs on a small dedicated pool so login bursts can't starve request threads
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.environ.get('PASSWORD_HASH_QUEUE', 32))
+app.config['LOGIN_ATTEMPTS_PER_IP'] = int(os.environ.get('LOGIN_ATTEMPTS_PER_IP', 20))
+app.config['LOGIN_ATTEMPTS_PER_USERNAME'] = int(os.environ.get('LOGIN_ATTEMPTS_PER_USERNAME', 10))
+app.config['LOGIN_ATTEMPT_WINDOW'] = int(os.environ.get('LOGIN_ATTEMPT_WINDOW', 300))
+# Number of reverse proxies in front of the app whose X-Forwarded-* headers can be trusted.
+# Without it every client behind a proxy shares the proxy's address and its login limit.
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'],
+                            x_proto=app.config['TRUSTED_PROXIES'], x_host=app.config['TRUSTED_PROXIES'])
+app.config['USER_CACHE_SIZE'] = 10000
+app.config['USER_CACHE_TTL'] = 60
+app.config['RECOMMENDATIONS_PER_PRODUCT'] = 4
+app.config['ORDER_SUMMARY_BATCH_ORDERS'] = 5000
+app.config['ORDERS_PER_PAGE'] = 10
+# Usernames allowed to read the sales analytics API
+app.config['ADMIN_USERS'] = {name.strip() for name in os.environ.get('ADMIN_USERS', '').split(',') if name.strip()}
+app.config['ANALYTICS_MAX_DAYS'] = 366
+app.json.compact = True
+
+class RoutingSession(FlaskSession):
+    """Session that sends queries from read-only routes to the 'read' bind, when one is configured."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context() and g.get('read_only') and 'read' in self._db.engines:
+            return self._db.engines['read']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def apply_sqlite_pragmas(engine, pragmas, read_only=False):
+    """Run the given PRAGMAs on every connection the engine opens."""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            # The journal mode is a property of the database file; a read-only connection can't change it
+            if read_only and name == 'journal_mode':
+                continue
+            cursor.execute(f'PRAGMA {name}={value}')
+        if read_only:
+            cursor.execute('PRAGMA query_only=ON')
+        cursor.close()
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+with app.app_context():
+    for bind_key, engine in db.engines.items():
+        apply_sqlite_pragmas(engine, app.config['SQLITE_PRAGMAS'], read_only=bind_key == 'read')
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -24,24 +141,38 @@ class User(UserMixin, db.Model):
 
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    # Merchant stock-keeping unit; catalog imports upsert on it
+    sku = db.Column(db.String(64), unique=True, index=True)
     name = db.Column(db.String(100), nullable=False)
     price = db.Column(db.Float, nullable=False)
     description = db.Column(db.Text)
     category = db.Column(db.String(50), nullable=False, default='Electronics')
     image_url = db.Column(db.String(500), nullable=False, default="https://picsum.photos/seed/default/500/300")
+    # Units on hand; None means stock isn't tracked for this product
+    stock = db.Column(db.Integer)
     cart_items = db.relationship('CartItem', backref='product', lazy=True)
     order_items = db.relationship('OrderItem', backref='product', lazy=True)
 
+    # Composite indexes backing the keyset-paginated catalog listing, one per
+    # sort order, with and without the category filter
+    __table_args__ = (
+        db.Index('ix_product_category_id', 'category', 'id'),
+        db.Index('ix_product_category_price_id', 'category', 'price', 'id'),
+        db.Index('ix_product_category_name_id', 'category', 'name', 'id'),
+        db.Index('ix_product_price_id', 'price', 'id'),
+        db.Index('ix_product_name_id', 'name', 'id'),
+    )
+
 class CartItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, default=1)
 
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    date_ordered = db.Column(db.DateTime, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    date_ordered = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     total_amount = db.Column(db.Float, nullable=False)
     shipping_address = db.Column(db.String(200), nullable=False)
     shipping_city = db.Column(db.String(100), nullable=False)
@@ -51,46 +182,787 @@ class Order(db.Model):
 
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Float, nullable=False)
 
+class ProductAffinity(db.Model):
+    """How many orders contained both products: the "frequently bought together" index."""
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    related_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    score = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_product_affinity_rank', 'product_id', 'score', 'related_id'),
+    )
+
+class OrderWatermark(db.Model):
+    """The last order folded into each incrementally maintained order summary."""
+    name = db.Column(db.String(50), primary_key=True)
+    last_order_id = db.Column(db.Integer, nullable=False, default=0)
+
+class DailySales(db.Model):
+    """Orders and revenue per (UTC) day and shipping state."""
+    day = db.Column(db.Date, primary_key=True)
+    shipping_state = db.Column(db.String(100), primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+class DailyProductSales(db.Model):
+    """Units sold and revenue per (UTC) day and product."""
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+class DailyCategorySales(db.Model):
+    """Units sold and revenue per (UTC) day and product category."""
+    day = db.Column(db.Date, primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+# Users
+class SessionUser(UserMixin):
+    """Lightweight identity for a logged-in user, safe to share between requests."""
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+user_cache = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    def load():
+        user = db.session.get(User, int(user_id))
+        return SessionUser(user.id, user.username) if user else None
+    return user_cache.get_or_set(int(user_id), load)
+
+@event.listens_for(Session, 'after_flush')
+def collect_user_changes(session, flush_context):
+    user_ids = session.info.setdefault('user_changes', set())
+    user_ids.update(obj.id for obj in chain(session.new, session.dirty, session.deleted) if isinstance(obj, User))
+
+@event.listens_for(Session, 'after_commit')
+def apply_user_changes(session):
+    for user_id in session.info.pop('user_changes', ()):
+        user_cache.delete(user_id)
+
+@event.listens_for(Session, 'after_rollback')
+def discard_user_changes(session):
+    session.info.pop('user_changes', None)
+
+# Passwords
+class PasswordHasherBusy(Exception):
+    pass
+
+password_pool = ThreadPoolExecutor(max_workers=app.config['PASSWORD_HASH_WORKERS'], thread_name_prefix='password-hash')
+# Hashing jobs running or queued; beyond this, new logins are turned away instead of piling up
+password_slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_WORKERS'] + app.config['PASSWORD_HASH_QUEUE'])
+login_ip_limiter = RateLimiter(app.config['LOGIN_ATTEMPTS_PER_IP'], app.config['LOGIN_ATTEMPT_WINDOW'])
+login_username_limiter = RateLimiter(app.config['LOGIN_ATTEMPTS_PER_USERNAME'], app.config['LOGIN_ATTEMPT_WINDOW'])
+
+def run_password_job(function, *args):
+    if not password_slots.acquire(blocking=False):
+        raise PasswordHasherBusy()
+    try:
+        return password_pool.submit(function, *args).result()
+    finally:
+        password_slots.release()
+
+def hash_password(password):
+    return run_password_job(generate_password_hash, password, app.config['PASSWORD_HASH_METHOD'])
+
+def verify_password(password_hash, password):
+    return run_password_job(check_password_hash, password_hash, password)
+
+def login_allowed(username):
+    """Count a login or registration attempt against the client's IP and the username."""
+    ip_allowed = login_ip_limiter.hit(request.remote_addr)
+    username_allowed = login_username_limiter.hit((username or '').lower())
+    return ip_allowed and username_allowed
+
+# Instrumentation
+metrics = Registry()
+request_latency = metrics.histogram(
+    'http_request_duration_seconds', 'Request latency by endpoint.', ('endpoint', 'method', 'status'))
+request_queries = metrics.histogram(
+    'http_request_sql_statements', 'SQL statements executed per request.', ('endpoint',),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 500))
+sql_latency = metrics.histogram(
+    'sql_statement_duration_seconds', 'SQL statement latency by statement type.', ('statement',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0))
+slow_queries = metrics.counter('sql_slow_statements_total', 'SQL statements slower than SLOW_QUERY_MS.')
+template_latency = metrics.histogram(
+    'template_render_duration_seconds', 'Template render time by template.', ('template',))
+
+def track_statements(engine):
+    # The start time lives on the execution context, which is discarded with the statement
+    # even when it fails and after_cursor_execute never runs
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+        context.statement_started = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context.statement_started
+        sql_latency.observe(elapsed, (statement.split(None, 1) or ['?'])[0].upper())
+        if has_request_context():
+            g.sql_statements = g.get('sql_statements', 0) + 1
+            g.sql_time = g.get('sql_time', 0.0) + elapsed
+        if elapsed * 1000 >= app.config['SLOW_QUERY_MS']:
+            slow_queries.inc()
+            app.logger.warning('Slow query (%.1f ms): %s', elapsed * 1000, ' '.join(statement.split()))
+
+with app.app_context():
+    for engine in db.engines.values():
+        track_statements(engine)
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.setdefault('template_timers', []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def record_template(sender, template, context, **extra):
+    timers = g.template_timers
+    elapsed = time.perf_counter() - timers.pop()
+    template_latency.observe(elapsed, template.name)
+    # Fragments rendered inside a page are already part of the page's time
+    if not timers:
+        g.template_time = g.get('template_time', 0.0) + elapsed
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = request.endpoint or 'unmatched'
+    request_latency.observe(elapsed, endpoint, request.method, response.status_code)
+    request_queries.observe(g.get('sql_statements', 0), endpoint)
+    if app.config['REQUEST_TIMING_HEADER']:
+        response.headers['Server-Timing'] = ', '.join([
+            f'app;dur={elapsed * 1000:.2f}',
+            f'db;dur={g.get("sql_time", 0.0) * 1000:.2f};desc="{g.get("sql_statements", 0)} statements"',
+            f'tpl;dur={g.get("template_time", 0.0) * 1000:.2f}',
+        ])
+    return response
+
+# Catalog pagination
+# Sort options: label, key columns (always ending in id so the order is total), descending
+PRODUCT_SORTS = {
+    'featured': ('Featured', ('id',), False),
+    'price_asc': ('Price: Low to High', ('price', 'id'), False),
+    'price_desc': ('Price: High to Low', ('price', 'id'), True),
+    'name': ('Name: A to Z', ('name', 'id'), False),
+}
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+# SQLite integers are signed 64-bit; binding anything bigger raises OverflowError
+SQL_INTEGER_RANGE = range(-2**63, 2**63)
+
+def is_sql_integer(value):
+    """Whether `value` is an int (not a bool) that fits in an SQLite INTEGER."""
+    return isinstance(value, int) and not isinstance(value, bool) and value in SQL_INTEGER_RANGE
+
+def valid_cursor_value(key, value):
+    """Whether `value` is a scalar of the type stored in the Product column `key`."""
+    if key == 'price':
+        return is_sql_integer(value) or (isinstance(value, float) and math.isfinite(value))
+    if key == 'name':
+        return isinstance(value, str)
+    return is_sql_integer(value)
+
+def decode_cursor(token, sort):
+    """Decode a page cursor, returning None if it is missing or doesn't match the sort."""
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    keys = PRODUCT_SORTS[sort][1]
+    if not isinstance(values, list) or len(values) != len(keys):
+        return None
+    if not all(valid_cursor_value(key, value) for key, value in zip(keys, values)):
+        return None
+    return values
+
+def paginate_products(category, sort, cursor, per_page):
+    """Fetch one page of products after `cursor` using keyset (seek) pagination.
+
+    Returns the products on the page and the cursor for the next page (None on the last page).
+    """
+    _, keys, descending = PRODUCT_SORTS[sort]
+    columns = [getattr(Product, key) for key in keys]
+    query = Product.query
+    if category != 'All':
+        query = query.filter(Product.category == category)
+    if cursor is not None:
+        position = tuple_(*columns)
+        query = query.filter(position < tuple(cursor) if descending else position > tuple(cursor))
+    order = [column.desc() if descending else column for column in columns]
+    products = query.order_by(*order).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(products) > per_page:
+        products = products[:per_page]
+        next_cursor = encode_cursor([getattr(products[-1], key) for key in keys])
+    return products, next_cursor
+
+# Catalog cache
+# Cached entries are immutable snapshots rather than ORM objects, so they can be shared
+# between requests without ever being attached to (or expired by) a session
+CatalogProduct = namedtuple('CatalogProduct', ['id', 'name', 'price', 'description', 'category', 'image_url', 'stock'])
+
+catalog_cache = TTLCache(maxsize=app.config['CATALOG_CACHE_SIZE'], ttl=app.config['CATALOG_CACHE_TTL'])
+# Rendered anonymous pages and per-product card fragments
+render_cache = TTLCache(maxsize=app.config['RENDER_CACHE_SIZE'], ttl=app.config['RENDER_CACHE_TTL'])
+# Bumped on every product write; listing and rendered pages are keyed by it so stale pages are never served
+catalog_version = 0
+catalog_updated_at = datetime.utcnow()
+# When each product's stock last changed at checkout. Only the product page shows stock, so
+# checkout bumps this instead of catalog_version and leaves every other cached page alone.
+stock_updated_at = {}
+
+metrics.callback_gauge(
+    'cache_hits_total', 'Cache lookups that found an entry.', type='counter', labelnames=('cache',),
+    callback=lambda: {('catalog',): catalog_cache.hits, ('render',): render_cache.hits})
+metrics.callback_gauge(
+    'cache_misses_total', 'Cache lookups that found nothing.', type='counter', labelnames=('cache',),
+    callback=lambda: {('catalog',): catalog_cache.misses, ('render',): render_cache.misses})
+metrics.callback_gauge(
+    'cache_entries', 'Entries currently cached.', labelnames=('cache',),
+    callback=lambda: {('catalog',): len(catalog_cache), ('render',): len(render_cache)})
+
+def snapshot_product(product):
+    return CatalogProduct(product.id, product.name, product.price, product.description,
+                          product.category, product.image_url, product.stock)
+
+def get_categories():
+    def load():
+        return [cat[0] for cat in db.session.query(Product.category).distinct()]
+    return catalog_cache.get_or_set(('categories',), load)
+
+def get_product(product_id):
+    """Return a cached snapshot of a product, or None if it doesn't exist."""
+    def load():
+        product = db.session.get(Product, product_id)
+        return snapshot_product(product) if product else None
+    return catalog_cache.get_or_set(('product', product_id), load)
+
+def get_related_products(product, limit=4):
+    """Return up to `limit` other products from the same category."""
+    def load():
+        query = Product.query.filter_by(category=product.category).order_by(Product.id).limit(limit + 1)
+        return [snapshot_product(related) for related in query]
+    candidates = catalog_cache.get_or_set(('related', product.category), load)
+    return [related for related in candidates if related.id != product.id][:limit]
+
+def get_recommended_products(product, limit=None):
+    """Return the products most often bought together with `product`.
+
+    Served from the affinity index with a single lookup; cached entries may lag new
+    orders by up to the cache TTL.
+    """
+    limit = limit or app.config['RECOMMENDATIONS_PER_PRODUCT']
+    def load():
+        query = (Product.query
+                 .join(ProductAffinity, ProductAffinity.related_id == Product.id)
+                 .filter(ProductAffinity.product_id == product.id)
+                 .order_by(ProductAffinity.score.desc(), ProductAffinity.related_id.desc())
+                 .limit(limit))
+        return [snapshot_product(related) for related in query]
+    return catalog_cache.get_or_set(('recommended', product.id, limit), load)
+
+def get_catalog_page(category, sort, cursor, per_page):
+    def load():
+        products, next_cursor = paginate_products(category, sort, cursor, per_page)
+        return [snapshot_product(product) for product in products], next_cursor
+    key = ('page', catalog_version, category, sort, tuple(cursor) if cursor else None, per_page)
+    return catalog_cache.get_or_set(key, load)
+
+def invalidate_catalog(product_ids=(), categories=()):
+    """Drop cached entries for the given products and categories."""
+    global catalog_version, catalog_updated_at
+    catalog_version += 1
+    catalog_updated_at = datetime.utcnow()
+    catalog_cache.delete(('categories',))
+    for product_id in product_ids:
+        catalog_cache.delete(('product', product_id))
+        for authenticated in (False, True):
+            render_cache.delete(('card', product_id, authenticated))
+    for category in categories:
+        catalog_cache.delete(('related', category))
+
+def invalidate_stock(product_ids):
+    """Drop cached copies of products whose stock changed, and their rendered product pages.
+
+    Listing snapshots keep the old stock until they expire, so neither the catalog pages
+    nor the listing API show it.
+    """
+    now = datetime.utcnow()
+    for product_id in product_ids:
+        catalog_cache.delete(('product', product_id))
+        stock_updated_at[product_id] = now
+
+@event.listens_for(Session, 'after_flush')
+def collect_catalog_changes(session, flush_context):
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Product):
+            product_ids, categories = session.info.setdefault('catalog_changes', (set(), set()))
+            product_ids.add(obj.id)
+            categories.add(obj.category)
+            # A product moved between categories leaves the old category's list stale too
+            categories.update(inspect(obj).attrs.category.history.deleted)
+
+@event.listens_for(Session, 'after_commit')
+def apply_catalog_changes(session):
+    changes = session.info.pop('catalog_changes', None)
+    if changes:
+        invalidate_catalog(*changes)
+
+@event.listens_for(Session, 'after_rollback')
+def discard_catalog_changes(session):
+    session.info.pop('catalog_changes', None)
+
+# Cart
+CartLine = namedtuple('CartLine', ['id', 'product_id', 'name', 'price', 'quantity', 'subtotal'])
+CartView = namedtuple('CartView', ['lines', 'total'])
+
+def load_cart(user_id):
+    """Load a user's cart lines together with their products in a single query."""
+    rows = (db.session.query(CartItem.id, CartItem.product_id, Product.name, Product.price, CartItem.quantity)
+            .join(Product, CartItem.product_id == Product.id)
+            .filter(CartItem.user_id == user_id)
+            .order_by(CartItem.id)
+            .all())
+    lines = [CartLine(cart_item_id, product_id, name, price, quantity, price * quantity)
+             for cart_item_id, product_id, name, price, quantity in rows]
+    return CartView(lines, sum(line.subtotal for line in lines))
+
+# Checkout
+class CheckoutError(Exception):
+    pass
+
+class EmptyCartError(CheckoutError):
+    pass
+
+class OutOfStockError(CheckoutError):
+    def __init__(self, product_names):
+        super().__init__(f"Not enough stock for: {', '.join(product_names)}")
+        self.product_names = product_names
+
+def place_order(user_id, shipping):
+    """Turn a user's cart into an order in one short write transaction and return the order.
+
+    The order row is inserted first so the write lock is taken before anything is read;
+    order items are then copied from the cart with a single INSERT ... SELECT, skipping any
+    line without a positive quantity; tracked stock is checked and decremented, the order is
+    folded into the order summaries, and the cart is emptied with one DELETE.
+    Raises EmptyCartError or OutOfStockError, rolling back, if the order can't be placed.
+    """
+    order = Order(
+        user_id=user_id,
+        total_amount=0,
+        shipping_address=shipping['address'],
+        shipping_city=shipping['city'],
+        shipping_state=shipping['state'],
+        shipping_zip=shipping['zip']
+    )
+    db.session.add(order)
+    try:
+        db.session.flush()
+
+        cart_lines = (select(literal(order.id), CartItem.product_id, CartItem.quantity, Product.price)
+                      .join(Product, CartItem.product_id == Product.id)
+                      .where(CartItem.user_id == user_id, CartItem.quantity > 0))
+        copied = db.session.execute(
+            insert(OrderItem).from_select(['order_id', 'product_id', 'quantity', 'price'], cart_lines))
+        if not copied.rowcount:
+            raise EmptyCartError('Your cart is empty')
+
+        ordered = (select(OrderItem.product_id, func.sum(OrderItem.quantity).label('quantity'))
+                   .where(OrderItem.order_id == order.id)
+                   .group_by(OrderItem.product_id)
+                   .subquery())
+        stocked = db.session.execute(
+            select(Product.id, Product.name, Product.stock >= ordered.c.quantity)
+            .join(ordered, ordered.c.product_id == Product.id)
+            .where(Product.stock.is_not(None))
+        ).all()
+        short = [name for _, name, enough in stocked if not enough]
+        if short:
+            raise OutOfStockError(short)
+        if stocked:
+            db.session.execute(
+                update(Product)
+                .where(Product.id.in_([product_id for product_id, _, _ in stocked]))
+                .values(stock=Product.stock - select(ordered.c.quantity)
+                        .where(ordered.c.product_id == Product.id).scalar_subquery())
+                .execution_options(synchronize_session=False))
+
+        order.total_amount = db.session.scalar(
+            select(func.sum(OrderItem.price * OrderItem.quantity)).where(OrderItem.order_id == order.id))
+        # The sales rollups read the total from the order row
+        db.session.flush()
+        fold_placed_order(order.id)
+        db.session.execute(delete(CartItem).where(CartItem.user_id == user_id)
+                           .execution_options(synchronize_session=False))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # Stock is shown on product pages, so drop their cached copies
+    if stocked:
+        invalidate_stock([product_id for product_id, _, _ in stocked])
+    return order
+
+# Order summaries
+# Tables derived from orders -- the recommendation index and the daily sales rollups -- are
+# maintained incrementally. Each has a watermark naming the last order folded into it;
+# checkout folds in its own order, and update_order_summary() catches up on the rest.
+OrderSummary = namedtuple('OrderSummary', 'fold tables')
+
+def accumulate(model, keys, totals, rows):
+    """INSERT ... SELECT `rows` into `model`, adding the `totals` columns onto existing rows."""
+    statement = sqlite_insert(model).from_select(keys + totals, rows)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=keys,
+        set_={column: getattr(model, column) + statement.excluded[column] for column in totals}))
+
+def fold_orders_into_affinities(first_order_id, last_order_id):
+    """Add co-purchase counts for orders first_order_id..last_order_id to the affinity index."""
+    first, second = db.aliased(OrderItem), db.aliased(OrderItem)
+    pairs = (select(first.product_id, second.product_id, func.count(func.distinct(first.order_id)))
+             .join(second, (second.order_id == first.order_id) & (second.product_id != first.product_id))
+             .where(first.order_id.between(first_order_id, last_order_id))
+             .group_by(first.product_id, second.product_id))
+    accumulate(ProductAffinity, ['product_id', 'related_id'], ['score'], pairs)
+
+def fold_orders_into_sales(first_order_id, last_order_id):
+    """Add orders first_order_id..last_order_id to the daily sales rollups."""
+    day = func.date(Order.date_ordered)
+    in_range = Order.id.between(first_order_id, last_order_id)
+    accumulate(DailySales, ['day', 'shipping_state'], ['orders', 'revenue'],
+               select(day, Order.shipping_state, func.count(), func.sum(Order.total_amount))
+               .where(in_range)
+               .group_by(day, Order.shipping_state))
+    units, revenue = func.sum(OrderItem.quantity), func.sum(OrderItem.price * OrderItem.quantity)
+    items = select(day).join(OrderItem, OrderItem.order_id == Order.id).where(in_range)
+    accumulate(DailyProductSales, ['day', 'product_id'], ['units', 'revenue'],
+               items.add_columns(OrderItem.product_id, units, revenue)
+               .group_by(day, OrderItem.product_id))
+    accumulate(DailyCategorySales, ['day', 'category'], ['units', 'revenue'],
+               items.join(Product, Product.id == OrderItem.product_id)
+               .add_columns(Product.category, units, revenue)
+               .group_by(day, Product.category))
+
+ORDER_SUMMARIES = {
+    'recommendations': OrderSummary(fold_orders_into_affinities, (ProductAffinity,)),
+    'sales': OrderSummary(fold_orders_into_sales, (DailySales, DailyProductSales, DailyCategorySales)),
+}
+
+def advance_watermark(name, from_order_id, to_order_id):
+    """Move a summary's watermark between two orders, returning False if it was elsewhere.
+
+    Taking the write lock here first makes the check and the fold that follows atomic.
+    """
+    moved = db.session.execute(
+        update(OrderWatermark)
+        .where(OrderWatermark.name == name, OrderWatermark.last_order_id == from_order_id)
+        .values(last_order_id=to_order_id)
+        .execution_options(synchronize_session=False))
+    return moved.rowcount == 1
+
+def fold_placed_order(order_id):
+    """Fold a just-placed order into every order summary, as part of the checkout transaction.
+
+    A summary is only updated when it already covers every earlier order; otherwise the
+    order is left for update_order_summary() to pick up in order.
+    """
+    previous = db.session.scalar(select(func.max(Order.id)).where(Order.id < order_id)) or 0
+    for name, summary in ORDER_SUMMARIES.items():
+        if advance_watermark(name, previous, order_id):
+            summary.fold(order_id, order_id)
+
+def update_order_summary(name, rebuild=False, batch_orders=None, progress=None):
+    """Fold every order not yet in the named summary into it, a batch of orders at a time."""
+    summary = ORDER_SUMMARIES[name]
+    batch_orders = batch_orders or app.config['ORDER_SUMMARY_BATCH_ORDERS']
+    if rebuild:
+        for table in summary.tables:
+            db.session.execute(delete(table))
+        db.session.execute(update(OrderWatermark).where(OrderWatermark.name == name).values(last_order_id=0))
+        db.session.commit()
+    while True:
+        last_order_id = db.session.scalar(select(OrderWatermark.last_order_id).where(OrderWatermark.name == name))
+        batch_end = db.session.scalar(
+            select(func.max(Order.id)).where(Order.id.in_(
+                select(Order.id).where(Order.id > last_order_id).order_by(Order.id).limit(batch_orders))))
+        if batch_end is None:
+            return
+        if advance_watermark(name, last_order_id, batch_end):
+            summary.fold(last_order_id + 1, batch_end)
+        db.session.commit()
+        if progress:
+            progress(batch_end)
+
+def run_order_summary_update(name, rebuild, batch_orders):
+    create_schema()
+    update_order_summary(name, rebuild, batch_orders,
+                         progress=lambda order_id: click.echo(f'Folded in orders up to #{order_id}', err=True))
+
+@app.cli.command('update-recommendations')
+@click.option('--rebuild', is_flag=True, help='Recompute the index from every order instead of only new ones.')
+@click.option('--batch-orders', type=int, default=lambda: app.config['ORDER_SUMMARY_BATCH_ORDERS'], show_default='5000')
+def update_recommendations_command(rebuild, batch_orders):
+    """Fold orders placed since the last run into the "frequently bought together" index."""
+    run_order_summary_update('recommendations', rebuild, batch_orders)
+    click.echo('Recommendations up to date.')
+
+@app.cli.command('update-sales-rollups')
+@click.option('--rebuild', is_flag=True, help='Recompute the rollups from every order instead of only new ones.')
+@click.option('--batch-orders', type=int, default=lambda: app.config['ORDER_SUMMARY_BATCH_ORDERS'], show_default='5000')
+def update_sales_rollups_command(rebuild, batch_orders):
+    """Fold orders placed since the last run into the daily sales rollups."""
+    run_order_summary_update('sales', rebuild, batch_orders)
+    click.echo('Sales rollups up to date.')
+
+# Search
+# External-content FTS5 index over the product table, kept in sync by triggers
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+        name, description, category,
+        content='product', content_rowid='id', prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_insert AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_delete AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_update AFTER UPDATE OF name, description, category ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+        INSERT INTO product_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END""",
+]
+# Column weights for bm25(): name, description, category
+SEARCH_WEIGHTS = (10.0, 1.0, 4.0)
+# Control characters stand in for <mark> tags until the snippet has been HTML-escaped
+HIGHLIGHT_START, HIGHLIGHT_END = '\x02', '\x03'
+
+def create_search_index():
+    """Create the full-text index and its triggers, filling the index if it is new."""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    exists = inspect(db.engine).has_table('product_fts')
+    for statement in SEARCH_INDEX_DDL:
+        db.session.execute(text(statement))
+    if not exists:
+        rebuild_search_index()
+    db.session.commit()
+
+def rebuild_search_index():
+    db.session.execute(text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
+
+def build_match_query(terms, prefix=True):
+    """Turn free text into an FTS5 query matching every word, the last one as a prefix."""
+    words = re.findall(r'\w+', terms)
+    if not words:
+        return None
+    query = ' '.join('"%s"' % word for word in words)
+    return query + '*' if prefix else query
+
+def highlight(fragment):
+    return Markup(str(escape(fragment)).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>'))
+
+SearchResult = namedtuple('SearchResult', ['product', 'name_html', 'snippet_html'])
+
+def search_products(terms, limit, offset=0):
+    """Return products matching `terms`, best match first, with highlighted names and snippets."""
+    match = build_match_query(terms)
+    if match is None:
+        return []
+    rows = db.session.execute(text(f"""
+        SELECT product.id, product.name, product.price, product.description, product.category,
+               product.image_url, product.stock,
+               highlight(product_fts, 0, :start, :end) AS name_html,
+               snippet(product_fts, 1, :start, :end, '…', 16) AS snippet_html
+        FROM product_fts JOIN product ON product.id = product_fts.rowid
+        WHERE product_fts MATCH :match
+        ORDER BY bm25(product_fts, {', '.join(map(str, SEARCH_WEIGHTS))})
+        LIMIT :limit OFFSET :offset
+    """), {'match': match, 'start': HIGHLIGHT_START, 'end': HIGHLIGHT_END, 'limit': limit, 'offset': offset})
+    return [SearchResult(CatalogProduct(*row[:7]), highlight(row.name_html), highlight(row.snippet_html or ''))
+            for row in rows]
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Rebuild the product full-text search index from the product table."""
+    create_search_index()
+    rebuild_search_index()
+    db.session.commit()
+    click.echo('Search index rebuilt.')
+
+# Read routing
+def read_only(view):
+    """Mark a route as read-only so its queries can be served by the 'read' bind."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+# Render cache
+def cache_page(page_key=lambda: ()):
+    """Serve anonymous GETs of a catalog page from the render cache, with ETag/Last-Modified.
+
+    Pages are keyed on the view's URL arguments and `page_key()`: the query values the view
+    actually uses, once parsed and defaulted, or None for a page not worth caching. Junk or
+    unknown query parameters therefore share one cached copy instead of each adding one.
+    Logged-in users and requests with pending flash messages always get a fresh render.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if current_user.is_authenticated or session.get('_flashes'):
+                return view(*args, **kwargs)
+            query_key = page_key()
+            if query_key is None:
+                return view(*args, **kwargs)
+            # Product pages also change when checkout changes the product's stock
+            stock_changed = stock_updated_at.get(kwargs.get('product_id'))
+            key = ('page', request.endpoint, query_key, tuple(sorted(kwargs.items())),
+                   catalog_version, stock_changed)
+            cached = render_cache.get(key)
+            if cached is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                updated_at = max(catalog_updated_at, stock_changed) if stock_changed else catalog_updated_at
+                cached = (body, response.mimetype, hashlib.sha1(body).hexdigest(), updated_at)
+                render_cache.set(key, cached)
+            body, mimetype, etag, last_modified = cached
+            response = app.response_class(body, mimetype=mimetype)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            # Shared caches may keep the anonymous page but must revalidate it, and never reuse it for a logged-in user
+            response.cache_control.public = True
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+def catalog_page_args():
+    """The category, sort and decoded cursor a catalog page was asked for."""
+    category = request.args.get('category', 'All')
+    sort = request.args.get('sort', 'featured')
+    if sort not in PRODUCT_SORTS:
+        sort = 'featured'
+    return category, sort, decode_cursor(request.args.get('after'), sort)
+
+def catalog_page_key():
+    category, sort, cursor = catalog_page_args()
+    # Every made-up category renders its own (empty) page; don't let them fill the cache
+    if category != 'All' and category not in get_categories():
+        return None
+    return category, sort, tuple(cursor) if cursor else None
+
+def search_args():
+    """The search text and results page asked for, with the page clamped to the allowed range."""
+    query = request.args.get('q', '').strip()
+    page = min(max(request.args.get('page', 1, type=int), 1), app.config['SEARCH_MAX_PAGE'])
+    return query, page
+
+@app.template_global()
+def product_card(product):
+    """Render a catalog product card, reusing the cached fragment when there is one."""
+    key = ('card', product.id, current_user.is_authenticated)
+    return render_cache.get_or_set(key, lambda: Markup(render_template('_product_card.html', product=product)))
 
 # Routes
 @app.route('/')
+@read_only
+@cache_page(catalog_page_key)
 def home():
-    category = request.args.get('category', 'All')
-    if category == 'All':
-        products = Product.query.all()
-    else:
-        products = Product.query.filter_by(category=category).all()
+    category, sort, cursor = catalog_page_args()
+    products, next_cursor = get_catalog_page(category, sort, cursor, app.config['PRODUCTS_PER_PAGE'])
     
     # Get all unique categories for the filter dropdown
-    categories = ['All'] + [cat[0] for cat in db.session.query(Product.category).distinct()]
+    categories = ['All'] + get_categories()
     
-    return render_template('home.html', products=products, categories=categories, current_category=category)
+    return render_template('home.html', products=products, categories=categories, current_category=category,
+                           sorts=PRODUCT_SORTS, current_sort=sort, next_cursor=next_cursor,
+                           is_first_page=cursor is None)
 
 @app.route('/product/<int:product_id>')
+@read_only
+@cache_page()
 def product_detail(product_id):
-    product = Product.query.get_or_404(product_id)
+    product = get_product(product_id)
+    if product is None:
+        abort(404)
     # Get related products from the same category (excluding current product)
-    related_products = Product.query.filter_by(category=product.category).filter(Product.id != product.id).limit(4).all()
-    return render_template('product_detail.html', product=product, related_products=related_products)
+    related_products = get_related_products(product)
+    recommended_products = get_recommended_products(product)
+    return render_template('product_detail.html', product=product, related_products=related_products,
+                           recommended_products=recommended_products)
+
+@app.route('/search')
+@read_only
+@cache_page(search_args)
+def search():
+    query, page = search_args()
+    per_page = app.config['SEARCH_RESULTS_PER_PAGE']
+    results = search_products(query, per_page + 1, (page - 1) * per_page) if query else []
+    has_next = len(results) > per_page and page < app.config['SEARCH_MAX_PAGE']
+    return render_template('search.html', query=query, results=results[:per_page], page=page, has_next=has_next)
+
+@app.route('/search/suggest')
+@read_only
+def search_suggest():
+    """Type-ahead suggestions: product names matching the text typed so far."""
+    results = search_products(request.args.get('q', ''), 8)
+    return jsonify([{'id': result.product.id, 'name': result.product.name} for result in results])
+
+@app.route('/metrics')
+def metrics_endpoint():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
+        if not login_allowed(username):
+            flash('Too many login attempts. Please wait a few minutes and try again.')
+            return render_template('login.html'), 429
         user = User.query.filter_by(username=username).first()
         
-        if user and check_password_hash(user.password_hash, password):
-            login_user(user)
-            return redirect(url_for('home'))
+        try:
+            if user and verify_password(user.password_hash, password):
+                login_user(user)
+                return redirect(url_for('home'))
+        except PasswordHasherBusy:
+            flash('We are handling a lot of logins right now. Please try again in a moment.')
+            return render_template('login.html'), 503
         flash('Invalid username or password')
     return render_template('login.html')
 
@@ -99,12 +971,20 @@ def register():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
+        if not login_allowed(username):
+            flash('Too many attempts. Please wait a few minutes and try again.')
+            return render_template('register.html'), 429
         
         if User.query.filter_by(username=username).first():
             flash('Username already exists')
             return redirect(url_for('register'))
         
-        user = User(username=username, password_hash=generate_password_hash(password))
+        try:
+            password_hash = hash_password(password)
+        except PasswordHasherBusy:
+            flash('We are handling a lot of sign-ups right now. Please try again in a moment.')
+            return render_template('register.html'), 503
+        user = User(username=username, password_hash=password_hash)
         db.session.add(user)
         db.session.commit()
         return redirect(url_for('login'))
@@ -119,17 +999,23 @@ def logout():
 @app.route('/cart')
 @login_required
 def cart():
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-    total = sum(item.product.price * item.quantity for item in cart_items)
-    return render_template('cart.html', cart_items=cart_items, total=total)
+    cart = load_cart(current_user.id)
+    return render_template('cart.html', cart_items=cart.lines, total=cart.total)
 
 @app.route('/add_to_cart/<int:product_id>', methods=['POST'])
 @login_required
 def add_to_cart(product_id):
-    quantity = int(request.form.get('quantity', 1))
+    max_quantity = app.config['MAX_CART_QUANTITY']
+    try:
+        quantity = int(request.form.get('quantity', 1))
+    except ValueError:
+        quantity = 0
+    if not 1 <= quantity <= max_quantity:
+        flash(f'Quantity must be between 1 and {max_quantity}')
+        return redirect(url_for('product_detail', product_id=product_id))
     cart_item = CartItem.query.filter_by(user_id=current_user.id, product_id=product_id).first()
     if cart_item:
-        cart_item.quantity += quantity
+        cart_item.quantity = min(cart_item.quantity + quantity, max_quantity)
     else:
         cart_item = CartItem(user_id=current_user.id, product_id=product_id, quantity=quantity)
         db.session.add(cart_item)
@@ -149,52 +1035,456 @@ def remove_from_cart(cart_item_id):
 @app.route('/checkout')
 @login_required
 def checkout():
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-    if not cart_items:
+    cart = load_cart(current_user.id)
+    if not cart.lines:
         flash('Your cart is empty')
         return redirect(url_for('cart'))
-    total = sum(item.product.price * item.quantity for item in cart_items)
-    return render_template('checkout.html', cart_items=cart_items, total=total)
+    return render_template('checkout.html', cart_items=cart.lines, total=cart.total)
 
 @app.route('/process_checkout', methods=['POST'])
 @login_required
 def process_checkout():
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-    if not cart_items:
-        flash('Your cart is empty')
+    try:
+        place_order(current_user.id, request.form)
+    except CheckoutError as e:
+        flash(str(e))
         return redirect(url_for('cart'))
+    flash('Order placed successfully!')
+    return redirect(url_for('home'))
 
-    # Create new order
-    total_amount = sum(item.product.price * item.quantity for item in cart_items)
-    order = Order(
-        user_id=current_user.id,
-        total_amount=total_amount,
-        shipping_address=request.form['address'],
-        shipping_city=request.form['city'],
-        shipping_state=request.form['state'],
-        shipping_zip=request.form['zip']
+@app.route('/orders')
+@login_required
+def order_history():
+    """The user's orders, newest first, keyset-paginated on order id."""
+    after = request.args.get('after', type=int)
+    if not is_sql_integer(after):
+        after = None
+    query = (Order.query.filter_by(user_id=current_user.id)
+             .options(selectinload(Order.items).selectinload(OrderItem.product)))
+    if after is not None:
+        query = query.filter(Order.id < after)
+    per_page = app.config['ORDERS_PER_PAGE']
+    orders = query.order_by(Order.id.desc()).limit(per_page + 1).all()
+    next_cursor = orders[per_page - 1].id if len(orders) > per_page else None
+    return render_template('orders.html', orders=orders[:per_page], next_cursor=next_cursor,
+                           is_first_page=after is None)
+
+# JSON API
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+PRODUCT_FIELDS = CatalogProduct._fields
+# Listing pages are cached until a catalog change or their TTL, but checkout changes stock
+# without invalidating them, so only single-product lookups report it
+PRODUCT_LISTING_FIELDS = tuple(field for field in PRODUCT_FIELDS if field != 'stock')
+CART_LINE_FIELDS = CartLine._fields
+ORDER_FIELDS = ('id', 'date_ordered', 'total_amount', 'shipping_address', 'shipping_city',
+                'shipping_state', 'shipping_zip', 'items')
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+@api.errorhandler(ApiError)
+def handle_api_error(error):
+    return jsonify(error=error.message), error.status
+
+@api.errorhandler(404)
+def handle_api_not_found(error):
+    return jsonify(error='Not found'), 404
+
+def api_login_required(view):
+    """Like login_required, but answers 401 instead of redirecting to the login page."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            raise ApiError('Authentication required', 401)
+        return view(*args, **kwargs)
+    return wrapper
+
+def requested_fields(allowed):
+    """Parse the ?fields= selection, defaulting to every allowed field."""
+    fields = request.args.get('fields')
+    if not fields:
+        return allowed
+    selected = tuple(field.strip() for field in fields.split(',') if field.strip())
+    unknown = [field for field in selected if field not in allowed]
+    if unknown:
+        raise ApiError(f"Unknown fields: {', '.join(unknown)}")
+    return selected
+
+def page_size():
+    limit = request.args.get('limit', app.config['PRODUCTS_PER_PAGE'], type=int)
+    return min(max(limit, 1), app.config['API_MAX_PAGE_SIZE'])
+
+def serialize(record, fields):
+    return {field: getattr(record, field) for field in fields}
+
+def serialize_cart(cart, fields):
+    return {'items': [serialize(line, fields) for line in cart.lines], 'total': cart.total}
+
+def serialize_order(order, fields):
+    data = {}
+    for field in fields:
+        if field == 'items':
+            data['items'] = [{'product_id': item.product_id, 'quantity': item.quantity, 'price': item.price}
+                             for item in order.items]
+        elif field == 'date_ordered':
+            data['date_ordered'] = order.date_ordered.isoformat()
+        else:
+            data[field] = getattr(order, field)
+    return data
+
+def json_object():
+    """The request's JSON body, which must be an object if present."""
+    body = request.get_json(silent=True)
+    if body is None:
+        return {}
+    if not isinstance(body, dict):
+        raise ApiError('Expected a JSON object')
+    return body
+
+def apply_cart_operations(user_id, operations):
+    """Apply a batch of add/set/remove operations to a user's cart in one transaction.
+
+    Every operation is validated before any is applied, so a bad batch changes nothing.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ApiError('Expected a non-empty list of operations')
+    if len(operations) > app.config['API_MAX_CART_OPERATIONS']:
+        raise ApiError(f"At most {app.config['API_MAX_CART_OPERATIONS']} operations per request")
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('op') not in ('add', 'set', 'remove'):
+            raise ApiError("Each operation needs an 'op' of add, set or remove")
+        if not is_sql_integer(operation.get('product_id')):
+            raise ApiError("Each operation needs an integer 'product_id'")
+        quantity = operation.get('quantity', 1)
+        if operation['op'] != 'remove' and (not is_sql_integer(quantity) or
+                                            not 0 <= quantity <= app.config['MAX_CART_QUANTITY']):
+            raise ApiError(f"'quantity' must be an integer from 0 to {app.config['MAX_CART_QUANTITY']}")
+
+    product_ids = {operation['product_id'] for operation in operations}
+    known = set(db.session.scalars(select(Product.id).where(Product.id.in_(product_ids))))
+    if product_ids - known:
+        raise ApiError(f"Unknown products: {', '.join(map(str, sorted(product_ids - known)))}", 404)
+
+    items = {item.product_id: item
+             for item in CartItem.query.filter(CartItem.user_id == user_id, CartItem.product_id.in_(product_ids))}
+    for operation in operations:
+        product_id = operation['product_id']
+        item = items.get(product_id)
+        quantity = 0 if operation['op'] == 'remove' else operation.get('quantity', 1)
+        if operation['op'] == 'add' and item:
+            quantity = min(quantity + item.quantity, app.config['MAX_CART_QUANTITY'])
+        if quantity == 0:
+            if item:
+                db.session.delete(item)
+                del items[product_id]
+        elif item:
+            item.quantity = quantity
+        else:
+            items[product_id] = CartItem(user_id=user_id, product_id=product_id, quantity=quantity)
+            db.session.add(items[product_id])
+    db.session.commit()
+
+@api.route('/products')
+@read_only
+def api_products():
+    category = request.args.get('category', 'All')
+    sort = request.args.get('sort', 'featured')
+    if sort not in PRODUCT_SORTS:
+        raise ApiError(f"Unknown sort; expected one of {', '.join(PRODUCT_SORTS)}")
+    fields = requested_fields(PRODUCT_LISTING_FIELDS)
+    cursor = decode_cursor(request.args.get('after'), sort)
+    # Starting over from the first page, as the HTML catalog does, would loop a client forever
+    if request.args.get('after') and cursor is None:
+        raise ApiError("Invalid 'after' cursor for this sort")
+    products, next_cursor = get_catalog_page(category, sort, cursor, page_size())
+    return jsonify(items=[serialize(product, fields) for product in products], next=next_cursor)
+
+@api.route('/products/<int:product_id>')
+@read_only
+def api_product(product_id):
+    product = get_product(product_id)
+    if product is None:
+        abort(404)
+    return jsonify(serialize(product, requested_fields(PRODUCT_FIELDS)))
+
+@api.route('/cart')
+@api_login_required
+def api_cart():
+    return jsonify(serialize_cart(load_cart(current_user.id), requested_fields(CART_LINE_FIELDS)))
+
+@api.route('/cart', methods=['POST'])
+@api_login_required
+def api_update_cart():
+    """Apply a batch of cart operations, e.g. {"operations": [{"op": "add", "product_id": 3, "quantity": 2}]}."""
+    body = json_object()
+    apply_cart_operations(current_user.id, body.get('operations'))
+    return jsonify(serialize_cart(load_cart(current_user.id), requested_fields(CART_LINE_FIELDS)))
+
+@api.route('/orders')
+@api_login_required
+def api_orders():
+    fields = requested_fields(ORDER_FIELDS)
+    query = Order.query.filter_by(user_id=current_user.id)
+    if 'items' in fields:
+        query = query.options(selectinload(Order.items))
+    after = request.args.get('after', type=int)
+    if 'after' in request.args and not is_sql_integer(after):
+        raise ApiError("'after' must be an order id")
+    if after is not None:
+        query = query.filter(Order.id < after)
+    limit = page_size()
+    orders = query.order_by(Order.id.desc()).limit(limit + 1).all()
+    next_cursor = orders[limit - 1].id if len(orders) > limit else None
+    return jsonify(items=[serialize_order(order, fields) for order in orders[:limit]], next=next_cursor)
+
+@api.route('/orders', methods=['POST'])
+@api_login_required
+def api_place_order():
+    shipping = json_object()
+    missing = [key for key in ('address', 'city', 'state', 'zip')
+               if not isinstance(shipping.get(key), str) or not shipping[key].strip()]
+    if missing:
+        raise ApiError(f"Missing shipping fields: {', '.join(missing)}")
+    try:
+        order = place_order(current_user.id, shipping)
+    except EmptyCartError as e:
+        raise ApiError(str(e))
+    except OutOfStockError as e:
+        raise ApiError(str(e), 409)
+    return jsonify(serialize_order(order, ORDER_FIELDS)), 201
+
+def api_admin_required(view):
+    """Restrict an API route to the users named in ADMIN_USERS."""
+    @wraps(view)
+    @api_login_required
+    def wrapper(*args, **kwargs):
+        if current_user.username not in app.config['ADMIN_USERS']:
+            raise ApiError('Admin access required', 403)
+        return view(*args, **kwargs)
+    return wrapper
+
+@api.route('/analytics/sales')
+@read_only
+@api_admin_required
+def api_sales_analytics():
+    """Sales over the last `days` (UTC) days, read from the daily rollups rather than the orders."""
+    days = min(max(request.args.get('days', 30, type=int), 1), app.config['ANALYTICS_MAX_DAYS'])
+    top = min(max(request.args.get('top', 10, type=int), 1), app.config['API_MAX_PAGE_SIZE'])
+    until = datetime.utcnow().date()
+    since = until - timedelta(days=days - 1)
+
+    def totals(model, key, count, ranked=True, limit=None):
+        """(key, count, revenue) summed over the period, biggest revenue first when ranked."""
+        revenue = func.sum(model.revenue)
+        query = (select(key, func.sum(count), revenue)
+                 .where(model.day.between(since, until))
+                 .group_by(key)
+                 .order_by(revenue.desc() if ranked else key)
+                 .limit(limit))
+        return db.session.execute(query).all()
+
+    daily = totals(DailySales, DailySales.day, DailySales.orders, ranked=False)
+    states = totals(DailySales, DailySales.shipping_state, DailySales.orders)
+    categories = totals(DailyCategorySales, DailyCategorySales.category, DailyCategorySales.units)
+    products = totals(DailyProductSales, DailyProductSales.product_id, DailyProductSales.units, limit=top)
+    names = dict(db.session.execute(
+        select(Product.id, Product.name).where(Product.id.in_([product_id for product_id, _, _ in products]))).all())
+    return jsonify(
+        since=since.isoformat(),
+        until=until.isoformat(),
+        orders=sum(orders for _, orders, _ in daily),
+        revenue=round(sum(revenue for _, _, revenue in daily), 2),
+        daily=[{'day': day.isoformat(), 'orders': orders, 'revenue': round(revenue, 2)}
+               for day, orders, revenue in daily],
+        states=[{'state': state, 'orders': orders, 'revenue': round(revenue, 2)}
+                for state, orders, revenue in states],
+        categories=[{'category': category, 'units': units, 'revenue': round(revenue, 2)}
+                    for category, units, revenue in categories],
+        top_products=[{'product_id': product_id, 'name': names.get(product_id), 'units': units,
+                       'revenue': round(revenue, 2)} for product_id, units, revenue in products],
     )
-    db.session.add(order)
 
-    # Create order items
-    for cart_item in cart_items:
-        order_item = OrderItem(
-            order=order,
-            product_id=cart_item.product_id,
-            quantity=cart_item.quantity,
-            price=cart_item.product.price
-        )
-        db.session.add(order_item)
-        # Remove item from cart
-        db.session.delete(cart_item)
+app.register_blueprint(api)
+
+# Catalog import/export
+IMPORT_FIELDS = ('sku', 'name', 'price', 'description', 'category', 'image_url', 'stock')
+EXPORT_PRODUCT_FIELDS = ('id',) + IMPORT_FIELDS
+EXPORT_ORDER_FIELDS = ('id', 'user_id', 'date_ordered', 'total_amount', 'shipping_address', 'shipping_city',
+                       'shipping_state', 'shipping_zip')
+EXPORT_ORDER_ITEM_FIELDS = ('product_id', 'quantity', 'price')
+
+def file_format(path, fmt):
+    if fmt:
+        return fmt
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+def read_records(stream, fmt):
+    """Yield (line number, record dict) pairs from a CSV or JSON Lines stream, one at a time."""
+    if fmt == 'csv':
+        yield from enumerate(csv.DictReader(stream), start=2)
+        return
+    for line_number, line in enumerate(stream, start=1):
+        if line.strip():
+            try:
+                yield line_number, json.loads(line)
+            except ValueError as e:
+                yield line_number, e
+
+def normalize_product(record):
+    """Validate an imported record and convert it to a product row."""
+    if not isinstance(record, dict):
+        raise ValueError(str(record) if isinstance(record, Exception) else 'expected an object')
+    sku = str(record.get('sku') or '').strip()
+    name = str(record.get('name') or '').strip()
+    if not sku or not name:
+        raise ValueError('sku and name are required')
+    price = float(record.get('price'))
+    if not math.isfinite(price):
+        raise ValueError('price must be a finite number')
+    if price < 0:
+        raise ValueError('price must not be negative')
+    stock = record.get('stock')
+    stock = int(stock) if stock not in (None, '') else None
+    if stock is not None and stock < 0:
+        raise ValueError('stock must not be negative')
+    return {
+        'sku': sku,
+        'name': name,
+        'price': price,
+        'description': record.get('description') or '',
+        'category': record.get('category') or Product.__table__.c.category.default.arg,
+        'image_url': record.get('image_url') or Product.__table__.c.image_url.default.arg,
+        'stock': stock,
+    }
+
+def product_rows(records, on_error):
+    for line_number, record in records:
+        try:
+            yield normalize_product(record)
+        except (TypeError, ValueError, OverflowError) as e:
+            on_error(line_number, e)
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def upsert_products(rows):
+    """Insert or update a batch of product rows by SKU with a single executemany."""
+    statement = sqlite_insert(Product.__table__)
+    updates = {field: statement.excluded[field] for field in IMPORT_FIELDS if field != 'sku'}
+    # Feeds without stock counts leave the current count alone
+    updates['stock'] = func.coalesce(statement.excluded.stock, Product.__table__.c.stock)
+    db.session.execute(statement.on_conflict_do_update(index_elements=['sku'], set_=updates), rows)
+
+def write_records(stream, fmt, fields, records):
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(records)
+    else:
+        for record in records:
+            stream.write(json.dumps(record, separators=(',', ':'), default=str) + '\n')
+
+def stream_rows(statement, batch_size):
+    """Iterate over a query's rows as dicts, fetching `batch_size` rows at a time."""
+    rows = db.session.execute(statement.execution_options(yield_per=batch_size))
+    for row in rows:
+        record = dict(row._mapping)
+        if isinstance(record.get('date_ordered'), datetime):
+            record['date_ordered'] = record['date_ordered'].isoformat()
+        yield record
 
+@app.cli.command('import-catalog')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--batch-size', type=int, default=lambda: app.config['IMPORT_BATCH_SIZE'], show_default='1000')
+def import_catalog_command(path, fmt, batch_size):
+    """Upsert products from a CSV or JSON Lines file, matching on SKU."""
+    create_schema()
+    imported = skipped = 0
+    started = time.perf_counter()
+
+    def report_error(line_number, error):
+        nonlocal skipped
+        skipped += 1
+        if skipped <= 20:
+            click.echo(f'Line {line_number}: {error}', err=True)
+
+    with open(path, newline='', encoding='utf-8') as stream:
+        rows = product_rows(read_records(stream, file_format(path, fmt)), report_error)
+        for batch in batched(rows, batch_size):
+            upsert_products(batch)
+            db.session.commit()
+            imported += len(batch)
+            elapsed = time.perf_counter() - started
+            click.echo(f'{imported} products ({imported / elapsed:.0f}/s)', err=True)
+    elapsed = time.perf_counter() - started
+    click.echo(f'Imported {imported} products, skipped {skipped} invalid rows in {elapsed:.1f}s.')
+
+@app.cli.command('export-catalog')
+@click.argument('output', type=click.File('w', encoding='utf-8', lazy=False), default='-')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--batch-size', type=int, default=lambda: app.config['IMPORT_BATCH_SIZE'], show_default='1000')
+def export_catalog_command(output, fmt, batch_size):
+    """Stream every product to a CSV or JSON Lines file (stdout by default)."""
+    columns = [getattr(Product, field) for field in EXPORT_PRODUCT_FIELDS]
+    records = stream_rows(select(*columns).order_by(Product.id), batch_size)
+    write_records(output, file_format(output.name, fmt), EXPORT_PRODUCT_FIELDS, records)
+
+@app.cli.command('export-orders')
+@click.argument('output', type=click.File('w', encoding='utf-8', lazy=False), default='-')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--batch-size', type=int, default=lambda: app.config['IMPORT_BATCH_SIZE'], show_default='1000')
+def export_orders_command(output, fmt, batch_size):
+    """Stream every order to a file: one row per order item as CSV, one nested order per line as JSON Lines."""
+    fmt = file_format(output.name, fmt)
+    order_columns = [getattr(Order, field).label(f'order_{field}' if field == 'id' else field)
+                     for field in EXPORT_ORDER_FIELDS]
+    item_columns = [getattr(OrderItem, field) for field in EXPORT_ORDER_ITEM_FIELDS]
+    statement = (select(*order_columns, *item_columns)
+                 .join(OrderItem, OrderItem.order_id == Order.id)
+                 .order_by(Order.id, OrderItem.id))
+    records = stream_rows(statement, batch_size)
+    if fmt == 'csv':
+        fields = ('order_id',) + EXPORT_ORDER_FIELDS[1:] + EXPORT_ORDER_ITEM_FIELDS
+        write_records(output, fmt, fields, records)
+        return
+    orders = ({**{field: items[0]['order_id' if field == 'id' else field] for field in EXPORT_ORDER_FIELDS},
+               'items': [{field: item[field] for field in EXPORT_ORDER_ITEM_FIELDS} for item in items]}
+              for items in (list(group) for _, group in groupby(records, key=lambda record: record['order_id'])))
+    write_records(output, fmt, None, orders)
+
+def add_missing_columns():
+    """Add nullable columns introduced since the database was created, which create_all() won't do."""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                column_type = column.type.compile(db.engine.dialect)
+                db.session.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+    db.session.commit()
+
+def create_schema():
+    db.create_all()
+    add_missing_columns()
+    # create_all() skips tables that already exist, so add any indexes missing from older databases
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    create_search_index()
+    watermarks = sqlite_insert(OrderWatermark).values([{'name': name} for name in ORDER_SUMMARIES])
+    db.session.execute(watermarks.on_conflict_do_nothing())
     db.session.commit()
-    flash('Order placed successfully!')
-    return redirect(url_for('home'))
 
 def init_db():
     with app.app_context():
-        db.create_all()
+        create_schema()
         # Add sample products if none exist
         if Product.query.count() == 0:
             products = [
@@ -345,9 +1635,11 @@ def init_db():
                 Product(name="Tablet", price=499.99, category="Electronics", description="10-inch tablet with retina display", image_url="https://picsum.photos/seed/tablet/500/300"),
                 Product(name="Camera", price=799.99, category="Electronics", description="Professional DSLR camera with 4K video", image_url="https://picsum.photos/seed/camera/500/300")
             ]
-            for product in products:
-                db.session.add(product)
+            db.session.add_all(products)
             db.session.commit()
+        # Catch up on orders placed while checkout wasn't maintaining the summaries
+        for name in ORDER_SUMMARIES:
+            update_order_summary(name)
 
 if __name__ == '__main__':
     init_db()
@@ -0,0 +1,122 @@
+"""Helpers shared by the benchmark scripts."""
+import http.cookiejar
+import json
+import math
+import os
+import platform
+import re
+import subprocess
+import sys
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_PASSWORD = 'benchmark'
+
+
+def load_app(database):
+    """Import the app against the SQLite file `database`, with Server-Timing headers turned on."""
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(database)}'
+    os.environ['REQUEST_TIMING_HEADER'] = '1'
+    # Every virtual user logs in from the same address
+    os.environ.setdefault('LOGIN_ATTEMPTS_PER_IP', '1000000')
+    sys.path.insert(0, ROOT)
+    import app
+    return app
+
+
+class TestClient:
+    """Drives the app in-process through Flask's test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, json_body=None):
+        response = self.client.open(path, method=method, data=data, json=json_body)
+        return response.status_code, response.headers
+
+
+class HttpClient:
+    """Drives a running server over HTTP, keeping cookies and not following redirects."""
+
+    class _NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), self._NoRedirect())
+
+    def request(self, method, path, data=None, json_body=None):
+        headers = {}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            body = urllib.parse.urlencode(data).encode()
+        request = urllib.request.Request(self.base_url + path, data=body, method=method, headers=headers)
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return response.status, response.headers
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers
+
+
+def statement_count(headers):
+    """Number of SQL statements the request ran, from the Server-Timing header if present."""
+    match = re.search(r'desc="(\d+) statements"', headers.get('Server-Timing') or '')
+    return int(match.group(1)) if match else None
+
+
+def percentile(ordered, p):
+    index = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(latencies, statements, elapsed):
+    """Latency percentiles (ms), throughput and SQL statements per request for one set of samples."""
+    if not latencies:
+        return {'requests': 0}
+    ordered = sorted(latencies)
+    counted = [count for count in statements if count is not None]
+    return {
+        'requests': len(ordered),
+        'p50_ms': round(percentile(ordered, 50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 99) * 1000, 3),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'requests_per_second': round(len(ordered) / elapsed, 1) if elapsed else None,
+        'statements_per_request': round(sum(counted) / len(counted), 2) if counted else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, kind, args, results):
+    data = {
+        'kind': kind,
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'args': vars(args),
+        'results': results,
+    }
+    if path:
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+        print(f'Results written to {path}', file=sys.stderr)
+    else:
+        print(json.dumps(data, indent=2))
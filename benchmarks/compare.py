@@ -0,0 +1,53 @@
+"""Compare two benchmark result files from routes.py or load.py.
+
+    python benchmarks/compare.py results/before.json results/after.json
+"""
+import argparse
+import json
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'requests_per_second', 'statements_per_request')
+
+
+def rows(results):
+    """Flatten results into {name: summary}, whichever script produced them."""
+    if 'steps' in results:
+        return {**results['steps'], 'overall': results['overall']}
+    return results
+
+
+def change(before, after):
+    if before is None or after is None:
+        return ''
+    if not before:
+        return '' if not after else '   new'
+    return f'{(after - before) / before * 100:+6.1f}%'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before['kind'] != after['kind']:
+        parser.error(f"can't compare {before['kind']} results with {after['kind']} results")
+    print(f"before: {before['commit']} {before['timestamp']}")
+    print(f"after:  {after['commit']} {after['timestamp']}\n")
+
+    before_rows, after_rows = rows(before['results']), rows(after['results'])
+    print(f"{'':24}" + ''.join(f'{metric:>34}' for metric in METRICS))
+    for name in sorted(set(before_rows) | set(after_rows)):
+        old, new = before_rows.get(name, {}), after_rows.get(name, {})
+        cells = []
+        for metric in METRICS:
+            a, b = old.get(metric), new.get(metric)
+            cells.append(f'{a if a is not None else "-":>11} -> {b if b is not None else "-":>10} {change(a, b):>8}')
+        print(f'{name:24}' + ''.join(f'{cell:>34}' for cell in cells))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Generate a synthetic catalog, users and order history for benchmarking.
+
+Every generated user is named user<N> with the password "benchmark".
+
+    python benchmarks/datagen.py bench.db --products 100000 --users 1000 --orders 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import count
+
+from common import BENCHMARK_PASSWORD, load_app
+
+CATEGORIES = ['Electronics', 'Clothing', 'Home & Garden', 'Sports & Outdoors', 'Books & Media', 'Toys & Games']
+ADJECTIVES = ['Wireless', 'Portable', 'Classic', 'Smart', 'Compact', 'Deluxe', 'Ergonomic', 'Vintage',
+              'Waterproof', 'Premium', 'Lightweight', 'Heavy-Duty', 'Organic', 'Modular', 'Foldable']
+NOUNS = ['Speaker', 'Jacket', 'Lamp', 'Backpack', 'Kettle', 'Novel', 'Puzzle', 'Tent', 'Keyboard',
+         'Sneakers', 'Blender', 'Drone', 'Camera', 'Planter', 'Headphones', 'Board Game', 'Yoga Mat']
+FEATURES = ['long battery life', 'a two-year warranty', 'recycled materials', 'fast charging',
+            'a minimalist design', 'machine-washable fabric', 'an adjustable fit', 'low noise',
+            'weatherproof seals', 'stainless steel parts', 'a carrying case', 'voice control']
+
+
+def product_rows(total, rng):
+    for i in range(1, total + 1):
+        name = f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}'
+        yield {
+            'sku': f'BENCH-{i:07d}',
+            'name': name,
+            'price': round(rng.uniform(2, 2000), 2),
+            'description': f'{name} with {rng.choice(FEATURES)} and {rng.choice(FEATURES)}.',
+            'category': CATEGORIES[i % len(CATEGORIES)],
+            'image_url': f'https://picsum.photos/seed/bench{i % 500}/500/300',
+            # Track stock for a quarter of the catalog, with plenty on hand
+            'stock': rng.randint(1000, 100000) if i % 4 == 0 else None,
+        }
+
+
+def user_rows(total, password_hash):
+    for i in range(1, total + 1):
+        yield {'username': f'user{i}', 'password_hash': password_hash}
+
+
+def order_rows(total, users, products, rng, order_ids, prices):
+    """Yield (order, items) pairs spread over the last year."""
+    now = datetime.utcnow()
+    for _ in range(total):
+        order_id = next(order_ids)
+        items = []
+        for product_id in rng.sample(range(1, products + 1), rng.randint(1, 5)):
+            items.append({'order_id': order_id, 'product_id': product_id,
+                          'quantity': rng.randint(1, 3), 'price': prices[product_id]})
+        order = {
+            'id': order_id,
+            'user_id': rng.randint(1, users),
+            'date_ordered': now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600)),
+            'total_amount': round(sum(item['price'] * item['quantity'] for item in items), 2),
+            'shipping_address': f'{rng.randint(1, 9999)} Main St',
+            'shipping_city': 'Springfield',
+            'shipping_state': rng.choice(['CA', 'NY', 'TX', 'WA', 'IL', 'FL']),
+            'shipping_zip': f'{rng.randint(10000, 99999)}',
+        }
+        yield order, items
+
+
+def insert_batches(app, table, rows, batch_size, label):
+    started = time.perf_counter()
+    inserted = 0
+    for batch in app.batched(rows, batch_size):
+        app.db.session.execute(app.insert(table), batch)
+        app.db.session.commit()
+        inserted += len(batch)
+        print(f'\r{label}: {inserted} ({inserted / (time.perf_counter() - started):.0f}/s)', end='', file=sys.stderr)
+    print(file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database', help='SQLite file to create')
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--force', action='store_true', help='Replace the database if it exists')
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        if not args.force:
+            parser.error(f'{args.database} already exists; pass --force to replace it')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.database + suffix):
+                os.remove(args.database + suffix)
+
+    # Each batch is a single executemany; don't log every one as a slow query
+    os.environ.setdefault('SLOW_QUERY_MS', '60000')
+    app = load_app(args.database)
+    rng = random.Random(args.seed)
+    with app.app.app_context():
+        app.create_schema()
+        insert_batches(app, app.Product.__table__, product_rows(args.products, rng), args.batch_size, 'products')
+        password_hash = app.generate_password_hash(BENCHMARK_PASSWORD)
+        insert_batches(app, app.User.__table__, user_rows(args.users, password_hash), args.batch_size, 'users')
+
+        prices = dict(app.db.session.execute(app.select(app.Product.id, app.Product.price)).all())
+        orders = order_rows(args.orders, args.users, args.products, rng, count(1), prices)
+        started = time.perf_counter()
+        placed = 0
+        for batch in app.batched(orders, args.batch_size):
+            app.db.session.execute(app.insert(app.Order.__table__), [order for order, _ in batch])
+            app.db.session.execute(app.insert(app.OrderItem.__table__), [item for _, items in batch for item in items])
+            app.db.session.commit()
+            placed += len(batch)
+            print(f'\rorders: {placed} ({placed / (time.perf_counter() - started):.0f}/s)', end='', file=sys.stderr)
+        print(file=sys.stderr)
+
+        for name in app.ORDER_SUMMARIES:
+            started = time.perf_counter()
+            app.update_order_summary(name, batch_orders=args.batch_size, progress=lambda order_id: print(
+                f'\r{name}: {order_id} orders ({order_id / (time.perf_counter() - started):.0f}/s)',
+                end='', file=sys.stderr))
+            print(file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Concurrent load driver simulating shopper sessions: browse -> add_to_cart -> checkout.
+
+Each virtual user logs in as user<N> and repeatedly browses the catalog, views products,
+adds a few to the cart, views the cart and checks out. Drives the app in-process by
+default, or a running server with --url. Reports per-step and overall latency
+percentiles, requests per second and SQL statements per request.
+
+    python benchmarks/load.py bench.db --users 16 --duration 30 --output results/load.json
+    python benchmarks/load.py bench.db --url http://localhost:8080 --users 32
+"""
+import argparse
+import random
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+
+from common import BENCHMARK_PASSWORD, HttpClient, TestClient, load_app, statement_count, summarize, write_results
+from routes import SHIPPING
+
+
+def catalog_shape(database):
+    """Highest product id and the category list, read straight from the database file."""
+    connection = sqlite3.connect(database)
+    try:
+        max_id = connection.execute('SELECT MAX(id) FROM product').fetchone()[0]
+        categories = [row[0] for row in connection.execute('SELECT DISTINCT category FROM product')]
+    finally:
+        connection.close()
+    return max_id, categories
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, number, client, args, max_id, categories, deadline):
+        super().__init__(daemon=True)
+        self.number = number
+        self.client = client
+        self.args = args
+        self.max_id = max_id
+        self.categories = categories
+        self.deadline = deadline
+        self.rng = random.Random(args.seed + number)
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def step(self, name, method, path, data=None, expect=(200, 302), location=None):
+        """Time one request; it fails unless its status is in `expect` and any redirect goes to `location`."""
+        started = time.perf_counter()
+        status, headers = self.client.request(method, path, data=data)
+        self.samples[name].append((time.perf_counter() - started, statement_count(headers)))
+        redirected_elsewhere = location and urllib.parse.urlsplit(headers.get('Location') or '').path != location
+        if status not in expect or redirected_elsewhere:
+            self.errors[name] += 1
+        if self.args.think_time:
+            time.sleep(self.rng.uniform(0, self.args.think_time))
+
+    def session(self):
+        rng = self.rng
+        self.step('home', 'GET', f'/?category={rng.choice(self.categories)}&sort={rng.choice(["featured", "price_asc"])}')
+        added = False
+        for _ in range(rng.randint(1, 3)):
+            product_id = rng.randint(1, self.max_id)
+            self.step('product_detail', 'GET', f'/product/{product_id}')
+            if rng.random() < 0.7:
+                self.step('add_to_cart', 'POST', f'/add_to_cart/{product_id}', {'quantity': rng.randint(1, 2)},
+                          expect=(302,), location='/cart')
+                added = True
+        self.step('cart', 'GET', '/cart')
+        # Checking out an empty cart would fail by design, so only check out after adding something
+        if added and rng.random() < self.args.checkout_rate:
+            self.step('checkout', 'GET', '/checkout')
+            # Success redirects home; an empty cart or missing stock redirects back to /cart
+            self.step('process_checkout', 'POST', '/process_checkout', SHIPPING, expect=(302,), location='/')
+
+    def run(self):
+        user = self.number % self.args.accounts + 1
+        self.step('login', 'POST', '/login', {'username': f'user{user}', 'password': BENCHMARK_PASSWORD}, expect=(302,))
+        if self.errors['login']:
+            # Logged out, every cart and checkout step would just be redirected to /login
+            sys.stderr.write(f'Virtual user {self.number} could not log in as user{user}; stopping it\n')
+            return
+        while time.monotonic() < self.deadline:
+            self.session()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database', help='SQLite file made by datagen.py')
+    parser.add_argument('--url', help='Drive a running server instead of the in-process app')
+    parser.add_argument('--users', type=int, default=8, help='Concurrent virtual users')
+    parser.add_argument('--accounts', type=int, default=500, help='Distinct user<N> accounts to log in as')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds to run')
+    parser.add_argument('--checkout-rate', type=float, default=0.3, help='Fraction of sessions that check out')
+    parser.add_argument('--think-time', type=float, default=0, help='Maximum random pause between steps (s)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    max_id, categories = catalog_shape(args.database)
+    app = None if args.url else load_app(args.database).app
+
+    def make_client():
+        return HttpClient(args.url) if args.url else TestClient(app)
+
+    deadline = time.monotonic() + args.duration
+    started = time.perf_counter()
+    users = [VirtualUser(number, make_client(), args, max_id, categories, deadline) for number in range(args.users)]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    elapsed = time.perf_counter() - started
+
+    merged = defaultdict(list)
+    errors = defaultdict(int)
+    for user in users:
+        for name, samples in user.samples.items():
+            merged[name].extend(samples)
+        for name, count in user.errors.items():
+            errors[name] += count
+
+    def summary(samples):
+        return summarize([latency for latency, _ in samples], [count for _, count in samples], elapsed)
+
+    results = {'steps': {name: {**summary(samples), 'errors': errors[name]} for name, samples in sorted(merged.items())}}
+    results['overall'] = {**summary([sample for samples in merged.values() for sample in samples]),
+                          'errors': sum(errors.values())}
+    results['failed_logins'] = errors['login']
+    overall = results['overall']
+    print(f"{overall['requests']} requests, {overall['requests_per_second']} req/s, p50 {overall['p50_ms']} ms, "
+          f"p95 {overall['p95_ms']} ms, p99 {overall['p99_ms']} ms, {overall['errors']} errors", file=sys.stderr)
+    if errors['login']:
+        print(f"{errors['login']} of {args.users} virtual users could not log in; raise the server's "
+              f"LOGIN_ATTEMPTS_PER_IP or set TRUSTED_PROXIES", file=sys.stderr)
+    write_results(args.output, 'load', args, results)
+
+
+if __name__ == '__main__':
+    main()
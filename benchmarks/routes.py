@@ -0,0 +1,116 @@
+"""Micro-benchmark each storefront route through the Flask test client.
+
+Run against a database made by datagen.py. Reports latency percentiles, requests per
+second and SQL statements per request for every route, optionally writing them as JSON.
+
+    python benchmarks/routes.py bench.db --requests 200 --output results/routes.json
+"""
+import argparse
+import random
+import sys
+import time
+
+from common import BENCHMARK_PASSWORD, TestClient, load_app, statement_count, summarize, write_results
+
+SHIPPING = {'firstName': 'Bench', 'lastName': 'Mark', 'email': 'bench@example.com', 'address': '1 Main St',
+            'city': 'Springfield', 'state': 'CA', 'zip': '90000', 'cardName': 'Bench Mark',
+            'cardNumber': '4111111111111111', 'expiry': '12/30', 'cvv': '123'}
+
+
+def login(client, username):
+    status, _ = client.request('POST', '/login', data={'username': username, 'password': BENCHMARK_PASSWORD})
+    if status != 302:
+        raise SystemExit(f'Could not log in as {username}; generate the database with datagen.py')
+
+
+def fill_cart(client, product_ids, lines):
+    operations = [{'op': 'set', 'product_id': product_id, 'quantity': 1} for product_id in product_ids[:lines]]
+    client.request('POST', '/api/v1/cart', json_body={'operations': operations})
+
+
+def scenarios(app, rng, cart_lines):
+    """(name, client, setup, request) for every benchmarked route.
+
+    `setup` runs untimed before each request; `request` returns (method, path, form data).
+    """
+    with app.app.app_context():
+        max_id = app.db.session.scalar(app.select(app.func.max(app.Product.id)))
+        categories = app.get_categories()
+
+    def product_ids():
+        return rng.sample(range(1, max_id + 1), cart_lines)
+
+    anonymous = TestClient(app.app)
+    shopper = TestClient(app.app)
+    login(shopper, 'user1')
+    buyer = TestClient(app.app)
+    login(buyer, 'user2')
+    fill_cart(shopper, product_ids(), cart_lines)
+
+    def none():
+        pass
+
+    def refill():
+        fill_cart(buyer, product_ids(), cart_lines)
+
+    return [
+        ('home', anonymous, none, lambda: ('GET', '/', None)),
+        ('home_logged_in', shopper, none, lambda: ('GET', '/', None)),
+        ('home_category_sorted', anonymous, none,
+         lambda: ('GET', f'/?category={rng.choice(categories)}&sort=price_asc', None)),
+        ('product_detail', anonymous, none, lambda: ('GET', f'/product/{rng.randint(1, max_id)}', None)),
+        ('search', anonymous, none, lambda: ('GET', '/search?q=wireless+spea', None)),
+        ('search_suggest', anonymous, none, lambda: ('GET', '/search/suggest?q=lam', None)),
+        ('cart', shopper, none, lambda: ('GET', '/cart', None)),
+        ('checkout', shopper, none, lambda: ('GET', '/checkout', None)),
+        ('add_to_cart', shopper, none, lambda: ('POST', f'/add_to_cart/{rng.randint(1, max_id)}', {'quantity': 1})),
+        ('api_products', anonymous, none, lambda: ('GET', '/api/v1/products?fields=id,name,price', None)),
+        ('api_cart', shopper, none, lambda: ('GET', '/api/v1/cart', None)),
+        ('process_checkout', buyer, refill, lambda: ('POST', '/process_checkout', SHIPPING)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database', help='SQLite file made by datagen.py')
+    parser.add_argument('--requests', type=int, default=200, help='Timed requests per route')
+    parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per route first')
+    parser.add_argument('--cart-lines', type=int, default=5)
+    parser.add_argument('--cold', action='store_true', help='Clear the catalog and render caches before every request')
+    parser.add_argument('--only', nargs='*', help='Only run these routes')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    app = load_app(args.database)
+    rng = random.Random(args.seed)
+    results = {}
+    for name, client, setup, make_request in scenarios(app, rng, args.cart_lines):
+        if args.only and name not in args.only:
+            continue
+        latencies, statements = [], []
+        elapsed = 0.0
+        for i in range(args.warmup + args.requests):
+            setup()
+            if args.cold:
+                app.catalog_cache.clear()
+                app.render_cache.clear()
+            method, path, data = make_request()
+            started = time.perf_counter()
+            status, headers = client.request(method, path, data=data)
+            duration = time.perf_counter() - started
+            if status >= 400:
+                raise SystemExit(f'{name}: {method} {path} returned {status}')
+            if i >= args.warmup:
+                latencies.append(duration)
+                statements.append(statement_count(headers))
+                elapsed += duration
+        results[name] = summarize(latencies, statements, elapsed)
+        print(f"{name:24} p50 {results[name]['p50_ms']:8.2f} ms  p99 {results[name]['p99_ms']:8.2f} ms  "
+              f"{results[name]['statements_per_request']} statements", file=sys.stderr)
+
+    write_results(args.output, 'routes', args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Compare SQLite read/write throughput with default settings against the configured profile.
+
+Runs concurrent catalog readers and checkout-style writers against a scratch database,
+once with SQLite's defaults and once with the pragmas from SQLITE_PRAGMAS, and prints
+operations per second for each.
+
+    python benchmarks/sqlite_profile.py --readers 8 --writers 2 --seconds 10
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, delete, exc, insert, select
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, apply_sqlite_pragmas, db, CartItem, Product, User  # noqa: E402
+
+
+def make_engine(path, pragmas):
+    engine = create_engine(f'sqlite:///{path}', **app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+    if pragmas:
+        apply_sqlite_pragmas(engine, pragmas)
+    return engine
+
+
+def seed(engine, products, users):
+    db.metadata.create_all(engine)
+    categories = ['Electronics', 'Clothing', 'Home & Garden', 'Sports & Outdoors', 'Books & Media', 'Toys & Games']
+    with engine.begin() as conn:
+        conn.execute(insert(Product), [
+            {'name': f'Product {i}', 'price': round(random.uniform(5, 500), 2), 'description': 'Benchmark product',
+             'category': categories[i % len(categories)], 'image_url': 'https://picsum.photos/seed/bench/500/300'}
+            for i in range(products)
+        ])
+        conn.execute(insert(User), [{'username': f'user{i}', 'password_hash': 'x'} for i in range(users)])
+
+
+def run(engine, readers, writers, seconds, products, users):
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def bump(key):
+        with lock:
+            counts[key] += 1
+
+    def reader():
+        while time.monotonic() < deadline:
+            after = random.randint(0, products)
+            try:
+                with engine.connect() as conn:
+                    conn.execute(select(Product).where(Product.id > after).order_by(Product.id).limit(24)).all()
+                bump('reads')
+            except exc.OperationalError:
+                bump('errors')
+
+    def writer():
+        while time.monotonic() < deadline:
+            user_id = random.randint(1, users)
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(CartItem), [
+                        {'user_id': user_id, 'product_id': random.randint(1, products), 'quantity': 1}
+                        for _ in range(5)
+                    ])
+                    conn.execute(delete(CartItem).where(CartItem.user_id == user_id))
+                bump('writes')
+            except exc.OperationalError:
+                bump('errors')
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        'reads_per_second': round(counts['reads'] / seconds, 1),
+        'writes_per_second': round(counts['writes'] / seconds, 1),
+        'errors': counts['errors'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=100)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, pragmas in [('default', None), ('tuned', app.config['SQLITE_PRAGMAS'])]:
+            engine = make_engine(os.path.join(tmp, f'{name}.db'), pragmas)
+            seed(engine, args.products, args.users)
+            results[name] = run(engine, args.readers, args.writers, args.seconds, args.products, args.users)
+            engine.dispose()
+    results['pragmas'] = app.config['SQLITE_PRAGMAS']
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe, size-bounded LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=300, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires, value = entry
+                if expires > self.clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (self.clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def replace(self, key, value):
+        """Update an existing entry's value without renewing its expiry."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data[key] = (entry[0], value)
+
+    def get_or_set(self, key, loader):
+        """Return the cached value for `key`, calling `loader()` to fill it on a miss."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RateLimiter:
+    """Fixed-window rate limiter allowing at most `limit` hits per key every `window` seconds."""
+
+    def __init__(self, limit, window, maxsize=100000, clock=time.monotonic):
+        self.limit = limit
+        self.window = window
+        self._counts = TTLCache(maxsize=maxsize, ttl=window, clock=clock)
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        """Record a hit for `key`, returning False if it is over the limit for the current window."""
+        with self._lock:
+            count = self._counts.get(key, 0) + 1
+            if count == 1:
+                self._counts.set(key, count)
+            else:
+                # Keep the window's original expiry rather than extending it on every hit
+                self._counts.replace(key, count)
+            return count <= self.limit
@@ -0,0 +1,53 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATABASE = os.path.join(tempfile.mkdtemp(), 'shop.db')
+
+os.environ['DATABASE_URL'] = f'sqlite:///{DATABASE}'
+os.environ['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+# Every test client logs in from the same address
+os.environ['LOGIN_ATTEMPTS_PER_IP'] = '1000000'
+os.environ['LOGIN_ATTEMPTS_PER_USERNAME'] = '1000000'
+sys.path.insert(0, ROOT)
+
+import app as shop  # noqa: E402
+
+
+def remove_database():
+    with shop.app.app_context():
+        for engine in shop.db.engines.values():
+            engine.dispose()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(DATABASE + suffix):
+            os.remove(DATABASE + suffix)
+
+
+@pytest.fixture
+def app():
+    """The app against a fresh, empty database, inside an app context."""
+    remove_database()
+    for cache in (shop.catalog_cache, shop.render_cache, shop.user_cache):
+        cache.clear()
+    with shop.app.app_context():
+        shop.create_schema()
+        yield shop
+        shop.db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
+
+
+@pytest.fixture
+def add_products(app):
+    """Add `count` Electronics products named "Product <n>", priced 10 + n."""
+    def add(count):
+        app.db.session.add_all([app.Product(name=f'Product {i}', price=10.0 + i, category='Electronics',
+                                            description='', image_url='') for i in range(1, count + 1)])
+        app.db.session.commit()
+    return add
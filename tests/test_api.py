@@ -0,0 +1,69 @@
+import pytest
+from werkzeug.security import generate_password_hash
+
+SHIPPING = {'address': '1 Main St', 'city': 'Springfield', 'state': 'CA', 'zip': '90000'}
+
+
+@pytest.fixture
+def shopper(app, client, add_products):
+    add_products(3)
+    app.db.session.add(app.User(username='shopper', password_hash=generate_password_hash('secret', method='pbkdf2:sha256:1000')))
+    app.db.session.commit()
+    assert client.post('/login', data={'username': 'shopper', 'password': 'secret'}).status_code == 302
+    return client
+
+
+@pytest.mark.parametrize('body', [[1], 'str', 3])
+def test_non_object_bodies_are_rejected(shopper, body):
+    assert shopper.post('/api/v1/cart', json=body).status_code == 400
+    assert shopper.post('/api/v1/orders', json=body).status_code == 400
+
+
+@pytest.mark.parametrize('operation', [
+    {'op': 'add', 'product_id': True, 'quantity': 1},
+    {'op': 'add', 'product_id': 1, 'quantity': True},
+    {'op': 'set', 'product_id': 1.0, 'quantity': 1},
+    {'op': 'add', 'product_id': 10**30, 'quantity': 1},
+    {'op': 'add', 'product_id': 1, 'quantity': 10**30},
+    {'op': 'set', 'product_id': 1, 'quantity': 1001},
+    {'op': 'set', 'product_id': 1, 'quantity': -1},
+])
+def test_non_integer_ids_and_quantities_are_rejected(app, shopper, operation):
+    assert shopper.post('/api/v1/cart', json={'operations': [operation]}).status_code == 400
+    assert app.CartItem.query.count() == 0
+
+
+@pytest.mark.parametrize('field, value', [('address', {'x': 1}), ('city', 5), ('zip', ['90000']), ('state', ' ')])
+def test_shipping_fields_must_be_strings(shopper, field, value):
+    shopper.post('/api/v1/cart', json={'operations': [{'op': 'add', 'product_id': 1}]})
+    response = shopper.post('/api/v1/orders', json=dict(SHIPPING, **{field: value}))
+    assert response.status_code == 400
+    assert field in response.get_json()['error']
+
+
+def test_place_order(shopper):
+    shopper.post('/api/v1/cart', json={'operations': [{'op': 'add', 'product_id': 2, 'quantity': 2}]})
+    response = shopper.post('/api/v1/orders', json=SHIPPING)
+    assert response.status_code == 201
+    assert response.get_json()['total_amount'] == 24.0
+
+
+def test_product_listing_omits_stock(app, client, add_products):
+    add_products(2)
+    assert 'stock' not in client.get('/api/v1/products').get_json()['items'][0]
+    assert client.get('/api/v1/products?fields=id,stock').status_code == 400
+    assert 'stock' in client.get('/api/v1/products/1').get_json()
+
+
+def test_adding_caps_the_line_quantity(app, shopper):
+    for _ in range(2):
+        shopper.post('/api/v1/cart', json={'operations': [{'op': 'add', 'product_id': 1, 'quantity': 800}]})
+    assert app.CartItem.query.one().quantity == 1000
+
+
+def test_product_pages_follow_the_cursor(client, add_products):
+    add_products(3)
+    first = client.get('/api/v1/products?limit=2').get_json()
+    second = client.get(f"/api/v1/products?limit=2&after={first['next']}").get_json()
+    assert [item['id'] for item in first['items'] + second['items']] == [1, 2, 3]
+    assert second['next'] is None
@@ -0,0 +1,40 @@
+import pytest
+from werkzeug.security import generate_password_hash
+
+SHIPPING = {'address': '1 Main St', 'city': 'Springfield', 'state': 'CA', 'zip': '90000'}
+
+
+@pytest.fixture
+def shopper(app, client, add_products):
+    add_products(2)
+    app.db.session.get(app.Product, 1).stock = 5
+    app.db.session.add(app.User(username='shopper', password_hash=generate_password_hash('secret', method='pbkdf2:sha256:1000')))
+    app.db.session.commit()
+    assert client.post('/login', data={'username': 'shopper', 'password': 'secret'}).status_code == 302
+    return client
+
+
+@pytest.mark.parametrize('quantity', ['-10', '0', 'lots', '1001', str(10**30)])
+def test_add_to_cart_rejects_bad_quantities(app, shopper, quantity):
+    response = shopper.post('/add_to_cart/1', data={'quantity': quantity})
+    assert response.status_code == 302
+    assert response.headers['Location'] == '/product/1'
+    assert app.CartItem.query.count() == 0
+
+
+def test_checkout_skips_lines_without_a_positive_quantity(app, shopper):
+    app.db.session.add_all([app.CartItem(user_id=1, product_id=1, quantity=-10),
+                            app.CartItem(user_id=1, product_id=2, quantity=1)])
+    app.db.session.commit()
+    order = app.place_order(1, SHIPPING)
+    assert [(item.product_id, item.quantity) for item in order.items] == [(2, 1)]
+    assert order.total_amount == 12.0
+    assert app.db.session.get(app.Product, 1).stock == 5
+
+
+def test_checkout_of_only_non_positive_lines_is_empty(app, shopper):
+    app.db.session.add(app.CartItem(user_id=1, product_id=1, quantity=-10))
+    app.db.session.commit()
+    with pytest.raises(app.EmptyCartError):
+        app.place_order(1, SHIPPING)
+    assert app.db.session.get(app.Product, 1).stock == 5
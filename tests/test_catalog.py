@@ -0,0 +1,100 @@
+import base64
+import json
+
+import pytest
+
+
+def cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+@pytest.mark.parametrize('sort, values', [
+    ('price_asc', [[], 5]),
+    ('price_asc', [{}, 5]),
+    ('price_asc', ['cheap', 5]),
+    ('price_asc', [10.5, True]),
+    ('name', [3, 5]),
+    ('featured', [[5]]),
+    ('featured', ['5']),
+    ('featured', [10**30]),
+    ('price_asc', [10**30, 5]),
+    ('price_asc', [10.5, 10**30]),
+])
+def test_malformed_cursor_starts_from_first_page(app, client, sort, values, add_products):
+    add_products(3)
+    response = client.get('/', query_string={'sort': sort, 'after': cursor(values)})
+    assert response.status_code == 200
+    assert b'Product 1' in response.data
+
+    # API clients get told rather than silently sent back to the start
+    response = client.get('/api/v1/products', query_string={'sort': sort, 'after': cursor(values)})
+    assert response.status_code == 400
+
+
+def test_valid_cursor_pages_on(app):
+    assert app.decode_cursor(cursor([11.0, 1]), 'price_asc') == [11.0, 1]
+    assert app.decode_cursor(cursor(['Product 1', 1]), 'name') == ['Product 1', 1]
+    assert app.decode_cursor(cursor([1]), 'featured') == [1]
+
+
+def test_only_product_writes_invalidate_the_catalog(app, add_products):
+    add_products(2)
+    version = app.catalog_version
+    app.db.session.add(app.User(username='shopper', password_hash='x'))
+    app.db.session.add(app.CartItem(user_id=1, product_id=1, quantity=1))
+    app.db.session.commit()
+    assert app.catalog_version == version
+
+    app.db.session.get(app.Product, 2).price = 99.0
+    app.db.session.commit()
+    assert app.catalog_version == version + 1
+
+
+def test_checkout_refreshes_only_the_stocked_product_page(app, client, add_products):
+    add_products(2)
+    app.db.session.get(app.Product, 1).stock = 5
+    app.db.session.add(app.User(username='shopper', password_hash='x'))
+    app.db.session.commit()
+    home = client.get('/')
+    page = client.get('/product/1')
+    assert b'5 in stock' in page.data
+    version = app.catalog_version
+
+    app.db.session.add(app.CartItem(user_id=1, product_id=1, quantity=2))
+    app.db.session.commit()
+    app.place_order(1, {'address': '1 Main St', 'city': 'Springfield', 'state': 'CA', 'zip': '90000'})
+
+    assert app.catalog_version == version
+    misses = app.render_cache.misses
+    response = client.get('/', headers={'If-None-Match': home.headers['ETag']})
+    assert response.status_code == 304
+    assert app.render_cache.misses == misses
+    response = client.get('/product/1', headers={'If-None-Match': page.headers['ETag']})
+    assert response.status_code == 200
+    assert b'3 in stock' in response.data
+
+
+def test_unread_query_args_share_the_cached_page(app, client, add_products):
+    add_products(3)
+    client.get('/?category=Electronics')
+    entries = len(app.render_cache)
+    for i in range(5):
+        assert b'Product 1' in client.get(f'/?category=Electronics&utm_source={i}').data
+        assert client.get(f'/search?q=product&utm_source={i}').status_code == 200
+    # The first search renders once; the tagged home pages reuse the untagged one
+    assert len(app.render_cache) == entries + 1
+    assert b'Product 1' not in client.get('/?category=Clothing&utm_source=0').data
+
+
+def test_junk_query_values_share_the_cached_page(app, client, add_products):
+    add_products(3)
+    client.get('/')
+    client.get('/search?q=product')
+    entries = len(app.render_cache)
+    for i in range(20):
+        assert client.get(f'/?after=junk{i}').status_code == 200
+        assert client.get(f'/?sort=junk{i}').status_code == 200
+        assert client.get(f'/?category=Nothing{i}').status_code == 200
+        assert client.get(f'/search?q=product&page={1000 + i}').status_code == 200
+    # Only the clamped last search page is new
+    assert len(app.render_cache) == entries + 1
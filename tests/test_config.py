@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+
+@pytest.mark.parametrize('url', ['sqlite://', 'sqlite:///:memory:'])
+def test_in_memory_database_imports(url):
+    """In-memory SQLite uses a StaticPool, which rejects the pool sizing options."""
+    env = dict(os.environ, DATABASE_URL=url)
+    result = subprocess.run([sys.executable, '-c', 'import app; app.init_db()'], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+LOGIN_FROM_CLIENTS = '''
+import app
+client = app.app.test_client()
+for address in ('203.0.113.1', '203.0.113.2', '203.0.113.3'):
+    response = client.post('/login', data={'username': 'nobody', 'password': 'x'},
+                           headers={'X-Forwarded-For': address})
+    print(response.status_code)
+'''
+
+
+@pytest.mark.parametrize('trusted_proxies, statuses', [('0', ['200', '429', '429']), ('1', ['200', '200', '200'])])
+def test_login_limit_uses_forwarded_address_only_behind_trusted_proxies(tmp_path, trusted_proxies, statuses):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{tmp_path}/shop.db', TRUSTED_PROXIES=trusted_proxies,
+               LOGIN_ATTEMPTS_PER_IP='1', LOGIN_ATTEMPTS_PER_USERNAME='100')
+    subprocess.run([sys.executable, '-c', 'import app; app.init_db()'], cwd=ROOT, env=env, check=True)
+    result = subprocess.run([sys.executable, '-c', LOGIN_FROM_CLIENTS], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+    assert result.stdout.split() == statuses, result.stderr
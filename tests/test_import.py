@@ -0,0 +1,24 @@
+from click.testing import CliRunner
+
+
+def test_import_skips_invalid_rows(app, tmp_path):
+    feed = tmp_path / 'feed.csv'
+    feed.write_text('sku,name,price,stock\n'
+                    'A-1,Kettle,19.99,5\n'
+                    'A-2,Lamp,nan,\n'
+                    'A-3,Tent,inf,\n'
+                    'A-4,Drone,-1,\n'
+                    'A-5,Puzzle,9.50,-3\n'
+                    'A-6,Novel,12,\n')
+    (tmp_path / 'feed.jsonl').write_text('{"sku": "B-1", "name": "Mat", "price": 5, "stock": Infinity}\n')
+
+    result = CliRunner().invoke(app.app.cli, ['import-catalog', str(feed)])
+    assert result.exit_code == 0, result.output
+    assert 'skipped 4 invalid rows' in result.output
+    result = CliRunner().invoke(app.app.cli, ['import-catalog', str(tmp_path / 'feed.jsonl')])
+    assert result.exit_code == 0, result.output
+    assert 'skipped 1 invalid rows' in result.output
+
+    products = app.db.session.execute(app.select(app.Product.sku, app.Product.price, app.Product.stock)
+                                      .order_by(app.Product.sku)).all()
+    assert products == [('A-1', 19.99, 5), ('A-6', 12.0, None)]
@@ -0,0 +1,32 @@
+import time
+
+import pytest
+from sqlalchemy import exc, text
+
+
+def select_timings(app):
+    """(count, total seconds) recorded for SELECT statements so far."""
+    samples = {name: value for name, labels, value in app.sql_latency.samples() if labels == '{statement="SELECT"}'}
+    return samples.get('sql_statement_duration_seconds_count', 0), samples.get('sql_statement_duration_seconds_sum', 0.0)
+
+
+def test_failed_statements_are_not_timed(app):
+    with app.db.engine.connect() as connection:
+        count, total = select_timings(app)
+        for _ in range(3):
+            with pytest.raises(exc.OperationalError):
+                connection.execute(text('SELECT * FROM no_such_table'))
+            connection.rollback()
+        time.sleep(0.2)
+        assert connection.execute(text('SELECT 1')).scalar() == 1
+
+    new_count, new_total = select_timings(app)
+    assert new_count == count + 1
+    # Timed from its own start, not from one of the failed statements before the pause
+    assert new_total - total < 0.1
+
+
+def test_successful_statements_are_timed(app, client):
+    client.get('/product/1')
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'sql_statement_duration_seconds_count{statement="SELECT"}' in body
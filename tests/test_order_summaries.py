@@ -0,0 +1,84 @@
+from werkzeug.security import generate_password_hash
+
+
+def add_user(app, username='shopper'):
+    user = app.User(username=username, password_hash='x')
+    app.db.session.add(user)
+    app.db.session.commit()
+    return user.id
+
+
+def place(app, user_id, *product_ids):
+    app.db.session.add_all([app.CartItem(user_id=user_id, product_id=product_id, quantity=1)
+                            for product_id in product_ids])
+    app.db.session.commit()
+    return app.place_order(user_id, {'address': '1 Main St', 'city': 'Springfield', 'state': 'CA', 'zip': '90000'})
+
+
+def insert_order(app, user_id, *product_ids):
+    """Add an order directly, bypassing checkout and so the summaries."""
+    order = app.Order(user_id=user_id, total_amount=len(product_ids), shipping_address='1 Main St',
+                      shipping_city='Springfield', shipping_state='NY', shipping_zip='10000')
+    app.db.session.add(order)
+    app.db.session.flush()
+    app.db.session.add_all([app.OrderItem(order_id=order.id, product_id=product_id, quantity=1, price=1.0)
+                            for product_id in product_ids])
+    app.db.session.commit()
+
+
+def affinities(app):
+    return app.db.session.execute(
+        app.select(app.ProductAffinity.product_id, app.ProductAffinity.related_id, app.ProductAffinity.score)
+        .order_by(app.ProductAffinity.product_id, app.ProductAffinity.related_id)).all()
+
+
+def watermark(app, name):
+    return app.db.session.get(app.OrderWatermark, name).last_order_id
+
+
+def test_checkout_folds_order_into_summaries(app, add_products):
+    add_products(3)
+    user_id = add_user(app)
+    place(app, user_id, 1, 2, 3)
+    place(app, user_id, 1, 2)
+
+    assert affinities(app) == [(1, 2, 2), (1, 3, 1), (2, 1, 2), (2, 3, 1), (3, 1, 1), (3, 2, 1)]
+    assert watermark(app, 'recommendations') == watermark(app, 'sales') == 2
+    sales = app.db.session.execute(app.select(app.DailySales.orders, app.DailySales.revenue)).one()
+    assert sales.orders == 2
+    assert round(sales.revenue, 2) == 11 + 12 + 13 + 11 + 12
+
+
+def test_orders_added_outside_checkout_are_caught_up_once(app, add_products):
+    add_products(3)
+    user_id = add_user(app)
+    place(app, user_id, 1, 2)
+    insert_order(app, user_id, 2, 3)
+    # The watermark is behind, so checkout leaves this order for the catch-up too
+    place(app, user_id, 1, 3)
+    assert watermark(app, 'recommendations') == 1
+
+    app.update_order_summary('recommendations', batch_orders=1)
+    app.update_order_summary('recommendations')
+    assert watermark(app, 'recommendations') == 3
+    assert affinities(app) == [(1, 2, 1), (1, 3, 1), (2, 1, 1), (2, 3, 1), (3, 1, 1), (3, 2, 1)]
+
+    app.update_order_summary('recommendations', rebuild=True, batch_orders=2)
+    assert affinities(app) == [(1, 2, 1), (1, 3, 1), (2, 1, 1), (2, 3, 1), (3, 1, 1), (3, 2, 1)]
+
+
+
+def test_order_history_ignores_out_of_range_cursors(app, client, add_products):
+    add_products(2)
+    app.db.session.add(app.User(username='shopper',
+                                password_hash=generate_password_hash('secret', method='pbkdf2:sha256:1000')))
+    app.db.session.commit()
+    place(app, 1, 1, 2)
+    client.post('/login', data={'username': 'shopper', 'password': 'secret'})
+
+    for after in ('99999999999999999999999', '-99999999999999999999999', 'abc'):
+        response = client.get(f'/orders?after={after}')
+        assert response.status_code == 200
+        assert b'Order #1' in response.data
+        assert client.get(f'/api/v1/orders?after={after}').status_code == 400
+    assert client.get('/api/v1/orders?after=2').get_json()['items'][0]['id'] == 1
@@ -0,0 +1,14 @@
+import pytest
+
+
+@pytest.mark.parametrize('page', ['0', '-3', '101', str(10**30)])
+def test_out_of_range_pages_are_clamped(app, client, add_products, page):
+    add_products(3)
+    response = client.get('/search', query_string={'q': 'product', 'page': page})
+    assert response.status_code == 200
+
+
+def test_search_finds_products(app, client, add_products):
+    add_products(3)
+    response = client.get('/search', query_string={'q': 'product'})
+    assert b'<mark>Product</mark> 2' in response.data